@@ -3,12 +3,17 @@
 from trytond.pool import Pool
 from . import configuration
 from . import account
+from . import company
+from . import currency
 from . import cash_bank
 from . import document
 from . import receipt
 from . import transfer
 from . import convertion
 from . import party
+from . import timing
+from . import log_archive
+from . import ir
 
 
 def register():
@@ -19,11 +24,15 @@ def register():
         configuration.ConfigurationOther,
         account.Move,
         account.MoveLine,
+        company.Company,
+        currency.Currency,
         cash_bank.CashBank,
+        cash_bank.Balance,
         cash_bank.ReceiptType,
         document.DocumentType,
         document.Document,
         document.DocumentReceipt,
+        document.DocumentMovement,
         document.DocumentLog,
         receipt.ReceiptLog,
         receipt.Receipt,
@@ -34,6 +43,11 @@ def register():
         convertion.Convertion,
         convertion.DocumentConvertion,
         convertion.ConvertionLog,
+        timing.Timing,
+        timing.TimingStatistic,
+        timing.SlowOperation,
+        log_archive.LogArchive,
+        ir.Cron,
         module='cash_bank', type_='model')
     Pool.register(
         party.PartyReplace,
@@ -1,10 +1,18 @@
 # This file is part of Cash & Bank module.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
+from trytond import backend
+from trytond.cache import Cache
 from trytond.transaction import Transaction
 from trytond.pool import Pool
 from trytond.model import ModelView, ModelSQL, fields, Unique
 from trytond.pyson import Eval, If, Bool, Not, Or, Id
+from trytond.tools import reduce_ids, grouped_slice
+from sql import Literal
+from sql.aggregate import Max, Sum
+from sql.conditionals import Case
+from sql.functions import CurrentTimestamp
+from decimal import Decimal
 
 
 class CashBank(ModelSQL, ModelView):
@@ -45,6 +53,25 @@ class CashBank(ModelSQL, ModelView):
         setter='set_bank_account_owners')
     receipt_types = fields.One2Many('cash_bank.receipt_type',
         'cash_bank', 'Receipt types')
+    currency_digits = fields.Function(fields.Integer('Currency Digits'),
+        'get_currency_digits')
+    balance = fields.Function(fields.Numeric('Balance',
+            digits=(16, Eval('currency_digits', 2)),
+            depends=['currency_digits'],
+            help='Balance of the posted moves of the account.'),
+        'get_balance')
+    balance_confirmed = fields.Function(fields.Numeric('Balance Confirmed',
+            digits=(16, Eval('currency_digits', 2)),
+            depends=['currency_digits'],
+            help='Balance of the posted and draft moves of the account.'),
+        'get_balance')
+    documents_in_hand_total = fields.Function(fields.Numeric(
+            'Documents in Hand',
+            digits=(16, Eval('currency_digits', 2)),
+            depends=['currency_digits'],
+            help='Total of the documents received and not converted.'),
+        'get_balance')
+    _metadata_cache = Cache('cash_bank.cash_bank.metadata', context=False)
 
     @classmethod
     def __setup__(cls):
@@ -55,6 +82,9 @@ class CashBank(ModelSQL, ModelView):
                 Unique(t, t.account),
                 'Account can not be shared between Cash/Bank.'),
             ]
+        cls._buttons.update({
+                'rebuild_balance': {},
+                })
 
     @classmethod
     def __register__(cls, module_name):
@@ -100,6 +130,306 @@ class CashBank(ModelSQL, ModelView):
     def set_bank_account_owners(cls, lines, name, value):
         pass
 
+    def get_currency_digits(self, name):
+        return self.company.currency.digits
+
+    @classmethod
+    def get_balance(cls, cash_banks, names):
+        pool = Pool()
+        Move = pool.get('account.move')
+        MoveLine = pool.get('account.move.line')
+        Document = pool.get('cash_bank.document')
+        cash_bank = cls.__table__()
+        line_cash_bank = cls.__table__()
+        move = Move.__table__()
+        line = MoveLine.__table__()
+        document = Document.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {n: {c.id: Decimal('0.0') for c in cash_banks}
+            for n in names}
+        amount = line.debit - line.credit
+        for sub_ids in grouped_slice([c.id for c in cash_banks]):
+            sub_ids = list(sub_ids)
+            lines = line_cash_bank.join(line,
+                condition=line.account == line_cash_bank.account
+                ).join(move, condition=line.move == move.id
+                ).select(
+                    line_cash_bank.id.as_('cash_bank'),
+                    Sum(Case((move.state == 'posted', amount), else_=0)
+                        ).as_('balance'),
+                    Sum(amount).as_('balance_confirmed'),
+                    where=reduce_ids(line_cash_bank.id, sub_ids),
+                    group_by=[line_cash_bank.id])
+            documents = document.select(
+                document.current_cash_bank.as_('cash_bank'),
+                Sum(document.amount).as_('documents_in_hand_total'),
+                where=reduce_ids(document.current_cash_bank, sub_ids)
+                & (document.status == 'in_hand'),
+                group_by=[document.current_cash_bank])
+            cursor.execute(*cash_bank.join(lines, 'LEFT',
+                    condition=lines.cash_bank == cash_bank.id
+                    ).join(documents, 'LEFT',
+                    condition=documents.cash_bank == cash_bank.id
+                    ).select(
+                        cash_bank.id,
+                        lines.balance,
+                        lines.balance_confirmed,
+                        documents.documents_in_hand_total,
+                        where=reduce_ids(cash_bank.id, sub_ids)))
+            for row in cursor:
+                values = dict(zip(
+                        ['balance', 'balance_confirmed',
+                            'documents_in_hand_total'], row[1:]))
+                for name in names:
+                    if values[name] is not None:
+                        result[name][row[0]] = Decimal(str(values[name]))
+        return result
+
+    @classmethod
+    @ModelView.button
+    def rebuild_balance(cls, cash_banks):
+        Balance = Pool().get('cash_bank.balance')
+        Balance.rebuild(cash_banks)
+
+    @classmethod
+    def get_metadata(cls, cash_bank):
+        '''
+        Return a dictionary with the company, type, journal and account ids
+        of the cash/bank, cached until a cash/bank is modified
+        '''
+        cash_bank = int(cash_bank)
+        metadata = cls._metadata_cache.get(cash_bank)
+        if metadata is None:
+            metadata, = cls.read([cash_bank],
+                ['company', 'type', 'journal_cash_bank', 'account'])
+            cls._metadata_cache.set(cash_bank, metadata)
+        return metadata
+
+    @classmethod
+    def create(cls, vlist):
+        cash_banks = super(CashBank, cls).create(vlist)
+        cls._metadata_cache.clear()
+        return cash_banks
+
+    @classmethod
+    def write(cls, *args):
+        super(CashBank, cls).write(*args)
+        cls._metadata_cache.clear()
+
+    @classmethod
+    def delete(cls, cash_banks):
+        super(CashBank, cls).delete(cash_banks)
+        cls._metadata_cache.clear()
+
+
+class Balance(ModelSQL, ModelView):
+    "Cash/Bank Daily Balance"
+    __name__ = 'cash_bank.balance'
+    cash_bank = fields.Many2One('cash_bank.cash_bank', 'Cash/Bank',
+        required=True, readonly=True, ondelete='CASCADE')
+    date = fields.Date('Date', required=True, readonly=True)
+    amount = fields.Numeric('Amount', readonly=True,
+        digits=(16, Eval('currency_digits', 2)),
+        depends=['currency_digits'],
+        help='Movement of the day.')
+    posted_amount = fields.Numeric('Posted Amount', readonly=True,
+        digits=(16, Eval('currency_digits', 2)),
+        depends=['currency_digits'],
+        help='Posted movement of the day.')
+    balance = fields.Numeric('Balance', readonly=True,
+        digits=(16, Eval('currency_digits', 2)),
+        depends=['currency_digits'],
+        help='Balance at the end of the day.')
+    posted_balance = fields.Numeric('Posted Balance', readonly=True,
+        digits=(16, Eval('currency_digits', 2)),
+        depends=['currency_digits'],
+        help='Posted balance at the end of the day.')
+    currency_digits = fields.Function(fields.Integer('Currency Digits'),
+        'get_currency_digits')
+
+    @classmethod
+    def __setup__(cls):
+        super(Balance, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('cash_bank_date_uniq', Unique(t, t.cash_bank, t.date),
+                'Only one balance per Cash/Bank and date is allowed.'),
+            ]
+        cls._order.insert(0, ('date', 'DESC'))
+
+    @classmethod
+    def __register__(cls, module_name):
+        exist = backend.TableHandler.table_exist(cls._table)
+        super(Balance, cls).__register__(module_name)
+        if not exist:
+            cls.rebuild()
+
+    def get_currency_digits(self, name):
+        return self.cash_bank.company.currency.digits
+
+    @classmethod
+    def rebuild(cls, cash_banks=None):
+        'Compute again the balances from the move lines of the accounts'
+        if cash_banks is None:
+            cls._rebuild()
+        else:
+            for sub_ids in grouped_slice([c.id for c in cash_banks]):
+                cls._rebuild(list(sub_ids))
+
+    @classmethod
+    def _rebuild(cls, ids=None):
+        pool = Pool()
+        CashBank = pool.get('cash_bank.cash_bank')
+        Move = pool.get('account.move')
+        MoveLine = pool.get('account.move.line')
+        table = cls.__table__()
+        cash_bank = CashBank.__table__()
+        move = Move.__table__()
+        line = MoveLine.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        if ids is None:
+            cursor.execute(*table.delete())
+            where = Literal(True)
+        else:
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.cash_bank, ids)))
+            where = reduce_ids(cash_bank.id, ids)
+
+        amount = line.debit - line.credit
+        cursor.execute(*cash_bank.join(line,
+                condition=line.account == cash_bank.account
+                ).join(move, condition=line.move == move.id
+                ).select(
+                    cash_bank.id, move.date,
+                    Sum(amount),
+                    Sum(Case((move.state == 'posted', amount), else_=0)),
+                    where=where,
+                    group_by=[cash_bank.id, move.date],
+                    order_by=[cash_bank.id, move.date]))
+
+        values = []
+        current = None
+        for cash_bank_id, date, amount, posted_amount in cursor:
+            if cash_bank_id != current:
+                current = cash_bank_id
+                balance = posted_balance = Decimal('0.0')
+            amount = Decimal(str(amount or 0))
+            posted_amount = Decimal(str(posted_amount or 0))
+            balance += amount
+            posted_balance += posted_amount
+            values.append([
+                    cash_bank_id, date, amount, posted_amount,
+                    balance, posted_balance,
+                    transaction.user, CurrentTimestamp()])
+        for sub_values in grouped_slice(values):
+            cursor.execute(*table.insert(
+                    columns=[
+                        table.cash_bank, table.date,
+                        table.amount, table.posted_amount,
+                        table.balance, table.posted_balance,
+                        table.create_uid, table.create_date],
+                    values=list(sub_values)))
+
+    @classmethod
+    def apply(cls, deltas):
+        '''
+        Add the amounts of deltas to the balances.
+        deltas is a dictionary of (cash_bank id, date): (amount, posted)
+        '''
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        deltas = {k: v for k, v in deltas.items() if any(v)}
+        if not deltas:
+            return
+
+        def existing():
+            keys = set()
+            dates = list({d for _, d in deltas})
+            for sub_ids in grouped_slice(list({c for c, _ in deltas})):
+                cursor.execute(*table.select(table.cash_bank, table.date,
+                        where=reduce_ids(table.cash_bank, sub_ids)
+                        & table.date.in_(dates)))
+                keys.update(cursor)
+            return keys
+
+        missing = deltas.keys() - existing()
+        if missing:
+            # Prevent concurrent creation of the same day
+            cls.lock()
+            missing -= existing()
+        for cash_bank_id, date in missing:
+            cursor.execute(*table.select(
+                    table.balance, table.posted_balance,
+                    where=(table.cash_bank == cash_bank_id)
+                    & (table.date < date),
+                    order_by=[table.date.desc],
+                    limit=1))
+            balance, posted_balance = cursor.fetchone() or (0, 0)
+            cursor.execute(*table.insert(
+                    columns=[
+                        table.cash_bank, table.date,
+                        table.amount, table.posted_amount,
+                        table.balance, table.posted_balance,
+                        table.create_uid, table.create_date],
+                    values=[[
+                            cash_bank_id, date, 0, 0,
+                            balance, posted_balance,
+                            transaction.user, CurrentTimestamp()]]))
+
+        for (cash_bank_id, date), (amount, posted) in deltas.items():
+            cursor.execute(*table.update(
+                    columns=[table.amount, table.posted_amount],
+                    values=[
+                        table.amount + amount,
+                        table.posted_amount + posted],
+                    where=(table.cash_bank == cash_bank_id)
+                    & (table.date == date)))
+            # Later days carry the change in their balance
+            cursor.execute(*table.update(
+                    columns=[
+                        table.balance, table.posted_balance,
+                        table.write_uid, table.write_date],
+                    values=[
+                        table.balance + amount,
+                        table.posted_balance + posted,
+                        transaction.user, CurrentTimestamp()],
+                    where=(table.cash_bank == cash_bank_id)
+                    & (table.date >= date)))
+        transaction.counter += 1
+
+    @classmethod
+    def get_balances(cls, cash_banks, date):
+        '''
+        Return the balance and posted balance of each cash/bank at the end
+        of the date from the last balance of the day or before
+        '''
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {c.id: (Decimal('0.0'), Decimal('0.0')) for c in cash_banks}
+        for sub_ids in grouped_slice(list(result)):
+            last = table.select(
+                table.cash_bank, Max(table.date).as_('date'),
+                where=reduce_ids(table.cash_bank, sub_ids)
+                & (table.date <= date),
+                group_by=[table.cash_bank])
+            balance = cls.__table__()
+            cursor.execute(*balance.join(last,
+                    condition=(balance.cash_bank == last.cash_bank)
+                    & (balance.date == last.date)
+                    ).select(
+                        balance.cash_bank,
+                        balance.balance, balance.posted_balance))
+            for cash_bank_id, amount, posted_amount in cursor:
+                result[cash_bank_id] = (
+                    Decimal(str(amount)), Decimal(str(posted_amount)))
+        return result
+
 
 class ReceiptType(ModelSQL, ModelView):
     "Cash/Bank Receipt Type"
@@ -139,16 +469,59 @@ class ReceiptType(ModelSQL, ModelView):
             'invisible': Not(Bool(Eval('bank_account'))),
         }, depends=['bank_account'])
     active = fields.Boolean('Active')
+    _metadata_cache = Cache('cash_bank.receipt_type.metadata', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super(ReceiptType, cls).__setup__()
+        # Selections of the receipt line types per language
+        cls._receipt_line_types = {}
 
     @staticmethod
     def default_active():
         return True
 
+    @classmethod
+    def get_metadata(cls, receipt_type):
+        '''
+        Return a dictionary with the values of the receipt type used
+        by the receipts, cached until a receipt type is modified
+        '''
+        receipt_type = int(receipt_type)
+        metadata = cls._metadata_cache.get(receipt_type)
+        if metadata is None:
+            metadata, = cls.read([receipt_type], [
+                    'cash_bank', 'type', 'sequence', 'party_required',
+                    'bank_account', 'bank_account_required',
+                    'default_receipt_line_type'])
+            cls._metadata_cache.set(receipt_type, metadata)
+        return metadata
+
+    @classmethod
+    def create(cls, vlist):
+        receipt_types = super(ReceiptType, cls).create(vlist)
+        cls._metadata_cache.clear()
+        return receipt_types
+
+    @classmethod
+    def write(cls, *args):
+        super(ReceiptType, cls).write(*args)
+        cls._metadata_cache.clear()
+
+    @classmethod
+    def delete(cls, receipt_types):
+        super(ReceiptType, cls).delete(receipt_types)
+        cls._metadata_cache.clear()
+
     @classmethod
     def get_receipt_line_type(cls):
         pool = Pool()
         Line = pool.get('cash_bank.receipt.line')
-        return Line.fields_get(['type'])['type']['selection']
+        language = Transaction().language
+        if language not in cls._receipt_line_types:
+            cls._receipt_line_types[language] = Line.fields_get(
+                ['type'])['type']['selection']
+        return cls._receipt_line_types[language]
 
     @fields.depends('cash_bank', '_parent_cash_bank.type')
     def on_change_with_cash_bank_type(self, name=None):
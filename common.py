@@ -0,0 +1,267 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from weakref import WeakKeyDictionary
+from trytond.cache import Cache
+from trytond.model import ModelView
+from trytond.pool import Pool
+from trytond.tools import grouped_slice
+from trytond.transaction import Transaction
+from trytond.modules.log_action import write_log
+
+_transaction_caches = WeakKeyDictionary()
+_company_currency_cache = Cache('cash_bank.company_currency', context=False)
+
+
+def transaction_cache(name):
+    'Return the dictionary called name kept for the current transaction'
+    caches = _transaction_caches.setdefault(Transaction(), {})
+    return caches.setdefault(name, {})
+
+
+def invalidate_records(model, ids=None):
+    '''
+    Invalidate the caches of the records of model updated with SQL,
+    all its records if ids is None
+    '''
+    transaction = Transaction()
+    # Refresh the local caches
+    transaction.counter += 1
+    for cache in transaction.cache.values():
+        if model in cache:
+            if ids is None:
+                cache[model].clear()
+            else:
+                for id_ in ids:
+                    cache[model].pop(int(id_), None)
+
+
+def get_company_currency(company=None):
+    '''
+    Return the currency id and digits of the company or of the company
+    of the context, (None, 2) without company
+    '''
+    if company is None:
+        company = Transaction().context.get('company')
+    if not company:
+        return None, 2
+    company = int(company)
+    value = _company_currency_cache.get(company)
+    if value is None:
+        Company = Pool().get('company.company')
+        currency = Company(company).currency
+        value = (currency.id, currency.digits)
+        _company_currency_cache.set(company, value)
+    return tuple(value)
+
+
+def clear_company_currency():
+    _company_currency_cache.clear()
+
+
+class _LogBuffer(object):
+    'Data manager writing the buffered logs before the commit'
+
+    def __init__(self):
+        self.logs = []
+
+    def __eq__(self, other):
+        return isinstance(other, _LogBuffer)
+
+    def __hash__(self):
+        return hash(_LogBuffer)
+
+    def add(self, action, records):
+        self.logs.append((action, records))
+
+    def flush(self):
+        'Write the logs with one call per model and action'
+        grouped = defaultdict(list)
+        logs, self.logs = self.logs, []
+        for action, records in logs:
+            for record in records:
+                grouped[(record.__name__, action)].append(record)
+        for (_, action), records in grouped.items():
+            write_log(action, records)
+
+    def tpc_begin(self, transaction):
+        pass
+
+    def commit(self, transaction):
+        self.flush()
+
+    def tpc_vote(self, transaction):
+        pass
+
+    def tpc_finish(self, transaction):
+        _transaction_caches.get(transaction, {}).pop('cash_bank.log', None)
+
+    def tpc_abort(self, transaction):
+        self.logs = []
+        _transaction_caches.get(transaction, {}).pop('cash_bank.log', None)
+
+
+@contextmanager
+def buffered_logs():
+    '''
+    Buffer the logs added in the block until the end of the outermost
+    block, they are written anyway before the commit
+    '''
+    cache = transaction_cache('cash_bank.log')
+    cache['depth'] = cache.get('depth', 0) + 1
+    try:
+        yield
+    finally:
+        cache['depth'] -= 1
+    if not cache['depth'] and cache.get('buffer'):
+        cache['buffer'].flush()
+
+
+def add_log(action, records):
+    'Write the log of action for records or buffer it in buffered_logs'
+    if not records:
+        return
+    cache = transaction_cache('cash_bank.log')
+    if not cache.get('depth'):
+        write_log(action, records)
+        return
+    if 'buffer' not in cache:
+        cache['buffer'] = Transaction().join(_LogBuffer())
+    cache['buffer'].add(action, list(records))
+
+
+def find_period(company, date):
+    'Return the period id of the company for the date'
+    Period = Pool().get('account.period')
+    periods = transaction_cache('cash_bank.period')
+    key = (int(company), date)
+    if key not in periods:
+        periods[key] = Period.find(int(company), date=date)
+    return periods[key]
+
+
+def compute_currency(from_currency, amount, to_currency, date, round=True):
+    '''
+    Convert amount as Currency.compute does with the rates at date,
+    the rates are read once per transaction
+    '''
+    Currency = Pool().get('currency.currency')
+    if from_currency == to_currency:
+        return Currency.compute(
+            from_currency, amount, to_currency, round=round)
+
+    rates = transaction_cache('cash_bank.currency_rate')
+    key = (from_currency.id, to_currency.id, date)
+    if key not in rates:
+        with Transaction().set_context(date=date):
+            from_currency = Currency(from_currency.id)
+            to_currency = Currency(to_currency.id)
+            if not from_currency.rate or not to_currency.rate:
+                # Let Currency raise the missing rate error
+                return Currency.compute(
+                    from_currency, amount, to_currency, round=round)
+            rates[key] = (from_currency.rate, to_currency.rate)
+    from_rate, to_rate = rates[key]
+    amount = amount * to_rate / from_rate
+    if round:
+        amount = to_currency.round(amount)
+    return amount
+
+
+def get_sequence_numbers(sequence, count):
+    '''
+    Return count numbers of the sequence.
+    Incremental sequences reserve all the numbers with one update,
+    the non strict ones use the database sequence when there is one.
+    '''
+    pool = Pool()
+    Sequence = pool.get('ir.sequence')
+    transaction = Transaction()
+    if (count <= 0
+            or sequence.type != 'incremental'
+            or (not sequence._strict
+                and transaction.database.has_sequence())):
+        return [sequence.get() for _ in range(count)]
+
+    numbers = _reserve_numbers(sequence, count)
+    date = transaction.context.get('date')
+    prefix = Sequence._process(sequence.prefix, date=date)
+    suffix = Sequence._process(sequence.suffix, date=date)
+    return ['%s%s%s' % (prefix, '%%0%sd' % sequence.padding % n, suffix)
+        for n in numbers]
+
+
+def _reserve_numbers(sequence, count):
+    Sequence = sequence.__class__
+    transaction = Transaction()
+    # As ir.sequence get, the numbers are reserved whatever the access
+    # rights of the user
+    with transaction.set_context(user=False, _check_access=False), \
+            transaction.set_user(0):
+        if Sequence._strict:
+            Sequence.lock()
+        sequence = Sequence(sequence.id)
+        number_next = sequence.number_next_internal
+        increment = sequence.number_increment
+        Sequence.write([sequence], {
+                'number_next_internal': number_next + increment * count,
+                })
+    return [number_next + increment * i for i in range(count)]
+
+
+def queue_workflow(func):
+    '''
+    Decorate a workflow button to push it to the task queue by batches
+    when background processing is activated in the configuration.
+    Only calls made by the client are queued, the outcome of each batch
+    is written to the logs of its records.
+    '''
+    @wraps(func)
+    def wrapper(cls, records, *args, **kwargs):
+        Config = Pool().get('cash_bank.configuration')
+        transaction = Transaction()
+        name = func.__name__
+
+        if transaction.context.get('_cash_bank_queued'):
+            return _run_queued(cls, name, func, records, *args, **kwargs)
+
+        if records and transaction.context.get('_check_access'):
+            if Config.get_cached_multivalue('workflow_queue'):
+                # The worker does not check the access to the button
+                records = _check_button(cls, name, records)
+                batch = Config.get_cached_multivalue('workflow_queue_batch')
+                with transaction.set_context(_cash_bank_queued=True):
+                    for sub_records in grouped_slice(records, batch):
+                        getattr(cls.__queue__, name)(
+                            list(sub_records), *args, **kwargs)
+                return
+        return func(cls, records, *args, **kwargs)
+    return wrapper
+
+
+def _check_button(cls, name, records):
+    '''
+    Check the access to the button name as ModelView.button does
+    and return the records allowed by its rules
+    '''
+    def check(cls, records):
+        return records
+    check.__name__ = name
+    return ModelView.button(check)(cls, records)
+
+
+def _run_queued(cls, name, func, records, *args, **kwargs):
+    try:
+        result = func(cls, records, *args, **kwargs)
+    except Exception as exception:
+        ids = [r.id for r in records]
+        with Transaction().new_transaction() as transaction:
+            write_log('Background %s failed: %s' % (name, exception),
+                cls.browse(ids))
+            transaction.commit()
+        raise
+    add_log('Background %s done' % name, records)
+    return result
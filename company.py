@@ -0,0 +1,19 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+from trytond.pool import PoolMeta
+from .common import clear_company_currency
+
+
+class Company(metaclass=PoolMeta):
+    __name__ = 'company.company'
+
+    @classmethod
+    def write(cls, *args):
+        super(Company, cls).write(*args)
+        clear_company_currency()
+
+    @classmethod
+    def delete(cls, companies):
+        super(Company, cls).delete(companies)
+        clear_company_currency()
@@ -1,8 +1,10 @@
 # This file is part of Cash & Bank module.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
+from trytond.cache import Cache
 from trytond.pyson import Eval, Id
 from trytond.pool import Pool
+from trytond.transaction import Transaction
 from trytond.model import (
     ModelSingleton, ModelView, ModelSQL, fields)
 from trytond.modules.company.model import (
@@ -43,7 +45,31 @@ class Configuration(
         ('11', 'November'),
         ('12', 'December'),
         ], 'Month Allowed', sort=False))
-
+    workflow_queue = fields.MultiValue(fields.Boolean('Process in Background',
+        help='Confirm and post from the client are processed '
+        'by the task queue.'))
+    workflow_queue_batch = fields.MultiValue(fields.Integer(
+        'Background Batch Size',
+        states={
+            'invisible': ~Eval('workflow_queue'),
+            },
+        depends=['workflow_queue'],
+        help='Number of records processed by each task.'))
+    timing_statistics = fields.MultiValue(fields.Boolean('Record Timings',
+        help='Store the time spent in each phase of the workflows.'))
+    profile_workflow = fields.MultiValue(fields.Boolean('Profile Workflows',
+        help='Log the profile of the workflow calls slower than the '
+        'slow operation threshold, or of each call without threshold.\n'
+        'Activate only to reproduce a slow call.'))
+    slow_threshold = fields.MultiValue(fields.Float(
+        'Slow Operation Threshold',
+        help='Workflow calls taking more seconds are stored '
+        'as slow operations.\nLeave empty to disable.'))
+    log_retention = fields.MultiValue(fields.Integer('Log Retention',
+        help='Number of days the logs are kept before being archived.\n'
+        'Leave empty to keep them.'))
+    _multivalues_cache = Cache(
+        'cash_bank.configuration.multivalues', context=False)
 
     @classmethod
     def multivalue_model(cls, field):
@@ -52,12 +78,72 @@ class Configuration(
             return pool.get('cash_bank.configuration.account')
         if field == 'convertion_seq':
             return pool.get('cash_bank.configuration.sequences')
-        if field == 'month_allow':
+        if field in {'month_allow', 'workflow_queue',
+                'workflow_queue_batch', 'timing_statistics',
+                'profile_workflow', 'slow_threshold', 'log_retention'}:
             return pool.get('cash_bank.configuration.other')
         return super(Configuration, cls).multivalue_model(field)
 
+    @classmethod
+    def default_workflow_queue_batch(cls, **pattern):
+        return cls.multivalue_model(
+            'workflow_queue_batch').default_workflow_queue_batch()
 
-class ConfigurationAccount(ModelSQL, CompanyValueMixin):
+    @classmethod
+    def get_cached_multivalue(cls, name, company=None):
+        '''
+        Return the value of the multivalue field name for the company
+        or the company of the context.
+        The values are cached until the configuration is modified.
+        '''
+        if company is None:
+            company = Transaction().context.get('company')
+        company = int(company) if company else None
+        values = cls._multivalues_cache.get(company)
+        if values is None:
+            config = cls(1)
+            values = {}
+            for fname, field in cls._fields.items():
+                if not isinstance(field, fields.MultiValue):
+                    continue
+                value = config.get_multivalue(fname, company=company)
+                values[fname] = getattr(value, 'id', value)
+            cls._multivalues_cache.set(company, values)
+        value = values[name]
+        field = cls._fields[name]
+        if field._type == 'many2one' and value is not None:
+            value = Pool().get(field.model_name)(value)
+        return value
+
+    @classmethod
+    def write(cls, *args):
+        super(Configuration, cls).write(*args)
+        cls._multivalues_cache.clear()
+
+
+class ConfigurationCacheMixin(object):
+    'Clear the cache of the configuration when a value is modified'
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, vlist):
+        records = super(ConfigurationCacheMixin, cls).create(vlist)
+        Pool().get('cash_bank.configuration')._multivalues_cache.clear()
+        return records
+
+    @classmethod
+    def write(cls, *args):
+        super(ConfigurationCacheMixin, cls).write(*args)
+        Pool().get('cash_bank.configuration')._multivalues_cache.clear()
+
+    @classmethod
+    def delete(cls, records):
+        super(ConfigurationCacheMixin, cls).delete(records)
+        Pool().get('cash_bank.configuration')._multivalues_cache.clear()
+
+
+class ConfigurationAccount(
+        ConfigurationCacheMixin, ModelSQL, CompanyValueMixin):
     "Cash / Bank configuration Account"
     __name__ = 'cash_bank.configuration.account'
     account_transfer = fields.Many2One('account.account',
@@ -69,7 +155,8 @@ class ConfigurationAccount(ModelSQL, CompanyValueMixin):
             ])
 
 
-class ConfigurationSequences(ModelSQL, CompanyValueMixin):
+class ConfigurationSequences(
+        ConfigurationCacheMixin, ModelSQL, CompanyValueMixin):
     'Configuration Sequences'
     __name__ = 'cash_bank.configuration.sequences'
     convertion_seq = fields.Many2One(
@@ -82,7 +169,8 @@ class ConfigurationSequences(ModelSQL, CompanyValueMixin):
             ])
 
 
-class ConfigurationOther(ModelSQL, CompanyValueMixin):
+class ConfigurationOther(
+        ConfigurationCacheMixin, ModelSQL, CompanyValueMixin):
     'Configuration Other'
     __name__ = 'cash_bank.configuration.other'
     month_allow = fields.Selection([
@@ -100,3 +188,13 @@ class ConfigurationOther(ModelSQL, CompanyValueMixin):
         ('11', 'November'),
         ('12', 'December'),
         ], 'Month Allowed', sort=False)
+    workflow_queue = fields.Boolean('Process in Background')
+    workflow_queue_batch = fields.Integer('Background Batch Size')
+    timing_statistics = fields.Boolean('Record Timings')
+    profile_workflow = fields.Boolean('Profile Workflows')
+    slow_threshold = fields.Float('Slow Operation Threshold')
+    log_retention = fields.Integer('Log Retention')
+
+    @classmethod
+    def default_workflow_queue_batch(cls):
+        return 100
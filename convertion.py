@@ -3,11 +3,17 @@
 # the full copyright notices and license terms.
 from trytond.transaction import Transaction
 from trytond.pool import Pool
-from trytond.model import Workflow, ModelView, ModelSQL, fields
+from trytond.model import Workflow, ModelView, ModelSQL, fields, Index
 from trytond.pyson import Eval, If, Or
-from trytond.modules.log_action import LogActionMixin, write_log
+from trytond.modules.log_action import LogActionMixin
 from trytond.i18n import gettext
 from trytond.exceptions import UserError
+from trytond.tools import reduce_ids, grouped_slice
+from .common import (
+    get_sequence_numbers, queue_workflow, get_company_currency, add_log)
+from .instrumentation import instrumented, span
+from sql.aggregate import Sum
+from collections import defaultdict
 from decimal import Decimal
 
 _STATES = {
@@ -58,8 +64,7 @@ class Convertion(Workflow, ModelSQL, ModelView):
     documents = fields.Many2Many('cash_bank.document-cash_bank.convertion',
         'convertion', 'document', 'Documents',
         domain=[
-            ('last_receipt', '!=', None),
-            ('last_receipt.cash_bank.id', '=', Eval('cash_bank', -999)),
+            ('current_cash_bank', '=', Eval('cash_bank', -999)),
             If(Eval('state') == 'draft',
                 [
                     ('convertion', '=', None),
@@ -122,20 +127,11 @@ class Convertion(Workflow, ModelSQL, ModelView):
 
     @staticmethod
     def default_currency():
-        Company = Pool().get('company.company')
-        company = Transaction().context.get('company')
-        if company:
-            company = Company(company)
-            return company.currency.id
+        return get_company_currency()[0]
 
     @staticmethod
     def default_currency_digits():
-        Company = Pool().get('company.company')
-        company = Transaction().context.get('company')
-        if company:
-            company = Company(company)
-            return company.currency.digits
-        return 2
+        return get_company_currency()[1]
 
     @fields.depends('currency')
     def on_change_with_currency_digits(self, name=None):
@@ -145,9 +141,9 @@ class Convertion(Workflow, ModelSQL, ModelView):
 
     @fields.depends('documents')
     def on_change_documents(self):
-        self.total_documents = self.get_total_documents()
+        self.total_documents = self._get_total_documents()
 
-    def get_total_documents(self, name=None):
+    def _get_total_documents(self):
         total = Decimal('0.0')
         if self.documents:
             for doc in self.documents:
@@ -155,6 +151,29 @@ class Convertion(Workflow, ModelSQL, ModelView):
                     total += doc.amount
         return total
 
+    @classmethod
+    def get_total_documents(cls, convertions, name):
+        pool = Pool()
+        Document = pool.get('cash_bank.document')
+        DocumentConvertion = pool.get(
+            'cash_bank.document-cash_bank.convertion')
+        document = Document.__table__()
+        relation = DocumentConvertion.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {c.id: Decimal('0.0') for c in convertions}
+        for sub_ids in grouped_slice(list(result)):
+            cursor.execute(*relation.join(document,
+                    condition=relation.document == document.id
+                    ).select(
+                        relation.convertion, Sum(document.amount),
+                        where=reduce_ids(relation.convertion, sub_ids),
+                        group_by=[relation.convertion]))
+            for convertion_id, amount in cursor:
+                if amount is not None:
+                    result[convertion_id] = Decimal(str(amount))
+        return result
+
     def get_rec_name(self, name):
         if self.number:
             return self.number
@@ -168,18 +187,39 @@ class Convertion(Workflow, ModelSQL, ModelView):
     def set_number(cls, convertions):
         pool = Pool()
         Config = pool.get('cash_bank.configuration')
-        config = Config(1)
+        to_number = defaultdict(list)
         for convertion in convertions:
             if convertion.number:
                 continue
-            convertion.number = config.get_multivalue(
-                'convertion_seq', company=convertion.company.id).get()
+            to_number[convertion.company.id].append(convertion)
+        for company, company_convertions in to_number.items():
+            sequence = Config.get_cached_multivalue(
+                'convertion_seq', company=company)
+            numbers = get_sequence_numbers(
+                sequence, len(company_convertions))
+            for convertion, number in zip(company_convertions, numbers):
+                convertion.number = number
         cls.save(convertions)
 
+    @classmethod
+    def _add_document_movements(cls, convertions, direction):
+        'Append the movements of the documents of convertions'
+        Movement = Pool().get('cash_bank.document.movement')
+        Movement.add([{
+                    'document': document.id,
+                    'date': convertion.date,
+                    'type': 'convertion',
+                    'direction': direction,
+                    'cash_bank': convertion.cash_bank.id,
+                    'convertion': convertion.id,
+                    }
+                for convertion in convertions
+                for document in convertion.documents])
+
     @classmethod
     def create(cls, vlist):
         convertions = super(Convertion, cls).create(vlist)
-        write_log('Created', convertions)
+        add_log('Created', convertions)
         return convertions
 
     @classmethod
@@ -197,13 +237,15 @@ class Convertion(Workflow, ModelSQL, ModelView):
             for doc in convertion.documents:
                 doc.convertion = None
                 docs.append(doc)
-                write_log(
+            if convertion.documents:
+                add_log(
                     'Convertion ' + convertion.rec_name + ' deleted.',
-                    [doc])
+                    convertion.documents)
         Document.save(docs)
         super(Convertion, cls).delete(convertions)
 
     @classmethod
+    @instrumented
     @ModelView.button
     @Workflow.transition('draft')
     def draft(cls, convertions):
@@ -213,34 +255,48 @@ class Convertion(Workflow, ModelSQL, ModelView):
             for doc in convertion.documents:
                 doc.convertion = None
                 docs.append(doc)
-                write_log(
+            if convertion.documents:
+                add_log(
                     'Convertion ' + convertion.rec_name + ' to Draft.',
-                    [doc])
+                    convertion.documents)
         Document.save(docs)
-        write_log('Draft', convertions)
+        cls._add_document_movements(convertions, 'in')
+        add_log('Draft', convertions)
 
     @classmethod
+    @queue_workflow
+    @instrumented
     @ModelView.button
     @Workflow.transition('confirmed')
     def confirm(cls, convertions):
         Document = Pool().get('cash_bank.document')
-        docs = []
-        for convertion in convertions:
-            for doc in convertion.documents:
-                doc.convertion = convertion
-                write_log(
-                    'Convertion ' + convertion.rec_name + ' confirmed.',
-                    [doc])
-                docs.append(doc)
-        Document.save(docs)
-        cls.set_number(convertions)
-        write_log('Confirmed', convertions)
+        with span('documents'):
+            to_write = []
+            for convertion in convertions:
+                if convertion.documents:
+                    to_write.extend([list(convertion.documents), {
+                                'convertion': convertion.id,
+                                }])
+            if to_write:
+                Document.write(*to_write)
+        with span('set_number'):
+            cls.set_number(convertions)
+        with span('document_movements'):
+            cls._add_document_movements(convertions, 'out')
+        with span('log'):
+            for convertion in convertions:
+                if convertion.documents:
+                    add_log(
+                        'Convertion ' + convertion.rec_name + ' confirmed.',
+                        convertion.documents)
+            add_log('Confirmed', convertions)
 
     @classmethod
+    @instrumented
     @ModelView.button
     @Workflow.transition('cancel')
     def cancel(cls, convertions):
-        write_log('Cancelled', convertions)
+        add_log('Cancelled', convertions)
 
 
 class DocumentConvertion(ModelSQL):
@@ -251,6 +307,17 @@ class DocumentConvertion(ModelSQL):
     convertion = fields.Many2One('cash_bank.convertion', 'Convertion',
         ondelete='CASCADE', required=True)
 
+    @classmethod
+    def __setup__(cls):
+        super(DocumentConvertion, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.convertion, Index.Equality()),
+                    (t.document, Index.Equality())),
+                Index(t, (t.document, Index.Equality())),
+                })
+
 
 class ConvertionLog(LogActionMixin):
     "Convertion Logs"
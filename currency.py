@@ -0,0 +1,19 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+from trytond.pool import PoolMeta
+from .common import clear_company_currency
+
+
+class Currency(metaclass=PoolMeta):
+    __name__ = 'currency.currency'
+
+    @classmethod
+    def write(cls, *args):
+        super(Currency, cls).write(*args)
+        clear_company_currency()
+
+    @classmethod
+    def delete(cls, currencies):
+        super(Currency, cls).delete(currencies)
+        clear_company_currency()
@@ -1,11 +1,19 @@
 # This file is part of Cash & Bank module.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
+from trytond import backend
 from trytond.transaction import Transaction
 from trytond.pool import Pool
-from trytond.model import ModelView, ModelSQL, fields, Check
+from trytond.model import ModelView, ModelSQL, fields, Check, Index
 from trytond.pyson import Eval, Bool
-from trytond.modules.log_action import LogActionMixin, write_log
+from trytond.modules.log_action import LogActionMixin
+from trytond.tools import reduce_ids, grouped_slice
+from .common import get_company_currency, add_log, invalidate_records
+from sql import Null, Window, Literal, Column
+from sql.aggregate import Max
+from sql.conditionals import Case
+from sql.functions import CurrentTimestamp, RowNumber
+from collections import defaultdict
 from decimal import Decimal
 
 _STATES = {
@@ -49,6 +57,22 @@ class Document(ModelSQL, ModelView):
         readonly=True)
     convertion = fields.Many2One('cash_bank.convertion', 'Convertion',
         readonly=True)
+    current_cash_bank = fields.Many2One('cash_bank.cash_bank',
+        'Current Cash/Bank', readonly=True,
+        help='The Cash/Bank of the last receipt.')
+    status = fields.Selection([
+        (None, ''),
+        ('in_hand', 'In Hand'),
+        ('paid_out', 'Paid Out'),
+        ('converted', 'Converted'),
+        ('in_transit', 'In Transit'),
+        ], 'Status', readonly=True,
+        help='In Hand: received by a confirmed or posted receipt.\n'
+        'Paid Out: delivered by a receipt.\n'
+        'Converted: converted to cash.\n'
+        'In Transit: received by a draft or cancelled receipt.')
+    movements = fields.One2Many('cash_bank.document.movement', 'document',
+        'Movements', readonly=True)
     logs = fields.One2Many('cash_bank.document.log_action',
         'resource', 'Logs', readonly=True)
 
@@ -60,6 +84,23 @@ class Document(ModelSQL, ModelView):
             ('check_receipt_doc_amount', Check(t, t.amount > 0),
                 'Amount must be greater than zero.'),
             ]
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.current_cash_bank, Index.Equality()),
+                    (t.status, Index.Equality())),
+                Index(t, (t.last_receipt, Index.Equality())),
+                Index(t, (t.convertion, Index.Equality()),
+                    where=t.convertion != Null),
+                })
+
+    @classmethod
+    def __register__(cls, module_name):
+        exist = backend.TableHandler.table_exist(cls._table)
+        fill_status = exist and not cls.__table_handler__(
+            module_name).column_exist('status')
+        super(Document, cls).__register__(module_name)
+        if fill_status:
+            cls.update_status()
 
     @staticmethod
     def default_amount():
@@ -69,8 +110,10 @@ class Document(ModelSQL, ModelView):
     def default_currency_digits():
         return Document._get_currency_digits()
 
-    def get_currency_digits(self, name=None):
-        return Document._get_currency_digits()
+    @classmethod
+    def get_currency_digits(cls, documents, name):
+        digits = cls._get_currency_digits()
+        return {d.id: digits for d in documents}
 
     def get_rec_name(self, name):
         if self.type:
@@ -83,45 +126,273 @@ class Document(ModelSQL, ModelView):
 
     @staticmethod
     def _get_currency_digits():
-        Company = Pool().get('company.company')
-        company = Transaction().context.get('company')
-        if company:
-            company = Company(company)
-            return company.currency.digits
-        return 2
-
-    def set_previous_receipt(self):
-        Docs = Pool().get('cash_bank.document-cash_bank.receipt')
-
-        cur_receipt = None
-        if hasattr(self, 'last_receipt'):
-            cur_receipt = self.last_receipt
-
-        domain = [
-            ('document', '=', self.id)
-            ]
-        if cur_receipt:
-            domain.append(
-                ('receipt', '!=', cur_receipt.id)
-                )
+        return get_company_currency()[1]
+
+    @classmethod
+    def update_status(cls, documents=None, receipts=None):
+        '''
+        Set the current cash/bank and the status of the documents
+        or of the documents of the receipts from their last receipt.
+        All the documents are updated when none is given.
+        '''
+        pool = Pool()
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptType = pool.get('cash_bank.receipt_type')
+        table = cls.__table__()
+        receipt = Receipt.__table__()
+        receipt_type = ReceiptType.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        if documents is not None:
+            ids, column = list({d.id for d in documents}), table.id
+        elif receipts is not None:
+            ids, column = list({r.id for r in receipts}), table.last_receipt
+        else:
+            ids, column = None, None
+        if ids is not None and not ids:
+            return
+
+        last_receipts = receipt.join(receipt_type,
+            condition=receipt.type == receipt_type.id
+            ).select(
+                receipt.id.as_('receipt'),
+                receipt.cash_bank,
+                receipt.state,
+                receipt_type.type)
+        converted = table.convertion != Null
 
-        docs = Docs.search(domain, order=[('id', 'DESC')])
+        def update(where=Literal(True)):
+            cursor.execute(*table.update(
+                    columns=[table.current_cash_bank, table.status],
+                    values=[
+                        last_receipts.cash_bank,
+                        Case(
+                            (converted, 'converted'),
+                            (last_receipts.type == 'out', 'paid_out'),
+                            (last_receipts.state.in_(
+                                    ['confirmed', 'posted']), 'in_hand'),
+                            else_='in_transit')],
+                    from_=[last_receipts],
+                    where=(table.last_receipt == last_receipts.receipt)
+                    & where))
+            cursor.execute(*table.update(
+                    columns=[table.current_cash_bank, table.status],
+                    values=[
+                        Null, Case((converted, 'converted'), else_=Null)],
+                    where=(table.last_receipt == Null) & where))
 
-        lg = 'Returned to Receipt: '
-        if not docs:
-            self.last_receipt = None
-            lg += 'None'
+        if ids is None:
+            update()
         else:
-            self.last_receipt = docs[0].receipt
-            lg += self.last_receipt.rec_name
-        write_log(lg, [self])
+            for sub_ids in grouped_slice(ids):
+                update(reduce_ids(column, sub_ids))
+        invalidate_records(cls.__name__,
+            ids if documents is not None else None)
+
+    @classmethod
+    def set_previous_receipts(cls, documents, exclude=None):
+        '''
+        Return documents to the last receipt they were attached to
+        before their current one, ignoring receipts in exclude
+        '''
+        pool = Pool()
+        Receipt = pool.get('cash_bank.receipt')
+        DocumentReceipt = pool.get('cash_bank.document-cash_bank.receipt')
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        database = transaction.database
+
+        # Documents not yet saved have no previous receipt
+        ids = list({d.id for d in documents if d.id is not None and d.id >= 0})
+        previous = {}
+        for sub_ids in grouped_slice(ids):
+            document = cls.__table__()
+            relation = DocumentReceipt.__table__()
+            where = (reduce_ids(relation.document, sub_ids)
+                & ((document.last_receipt == Null)
+                    | (relation.receipt != document.last_receipt)))
+            if exclude:
+                where &= ~relation.receipt.in_(list(exclude))
+            query = relation.join(document,
+                condition=relation.document == document.id)
+            if database.has_window_functions():
+                rank = RowNumber(window=Window([relation.document],
+                        order_by=[relation.id.desc]))
+                query = query.select(
+                    relation.document, relation.receipt,
+                    rank.as_('rank'),
+                    where=where)
+                query = query.select(query.document, query.receipt,
+                    where=query.rank == 1)
+            else:
+                last = query.select(
+                    Max(relation.id).as_('id'),
+                    where=where,
+                    group_by=relation.document)
+                relation = DocumentReceipt.__table__()
+                query = relation.join(last,
+                    condition=relation.id == last.id
+                    ).select(relation.document, relation.receipt)
+            cursor.execute(*query)
+            previous.update(cursor)
+
+        to_update = defaultdict(list)
+        for document_id in ids:
+            to_update[previous.get(document_id)].append(document_id)
+        for receipt_id, document_ids in to_update.items():
+            for sub_ids in grouped_slice(document_ids):
+                cursor.execute(*table.update(
+                        columns=[
+                            table.last_receipt,
+                            table.write_uid, table.write_date],
+                        values=[
+                            receipt_id,
+                            transaction.user, CurrentTimestamp()],
+                        where=reduce_ids(table.id, sub_ids)))
+        transaction.counter += 1
+        cls.update_status(cls.browse(ids))
+
+        for receipt_id, document_ids in to_update.items():
+            lg = 'Returned to Receipt: '
+            if receipt_id is None:
+                lg += 'None'
+            else:
+                lg += Receipt(receipt_id).rec_name
+            add_log(lg, cls.browse(document_ids))
 
     @classmethod
     def create(cls, vlist):
         documents = super(Document, cls).create(vlist)
-        write_log('Created', documents)
+        cls.update_status([d for d, v in zip(documents, vlist)
+                if v.get('last_receipt') or v.get('convertion')])
+        add_log('Created', documents)
         return documents
 
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Receipt = pool.get('cash_bank.receipt')
+        Docs = pool.get('cash_bank.document-cash_bank.receipt')
+        super(Document, cls).write(*args)
+        documents = []
+        to_update = []
+        actions = iter(args)
+        for records, values in zip(actions, actions):
+            if 'amount' in values:
+                documents.extend(records)
+            if values.keys() & {'last_receipt', 'convertion'}:
+                to_update.extend(records)
+        if to_update:
+            cls.update_status(to_update)
+        if documents:
+            docs = Docs.search([
+                ('document', 'in', [d.id for d in documents]),
+                ])
+            Receipt.update_totals([d.receipt for d in docs])
+
+
+class DocumentMovement(ModelSQL, ModelView):
+    "Cash/Bank Document Movement"
+    __name__ = 'cash_bank.document.movement'
+    document = fields.Many2One('cash_bank.document', 'Document',
+        required=True, readonly=True, ondelete='CASCADE')
+    date = fields.Date('Date', required=True, readonly=True)
+    type = fields.Selection([
+        ('entry', 'Entry'),
+        ('exit', 'Exit'),
+        ('transfer', 'Transfer'),
+        ('convertion', 'Convertion'),
+        ], 'Type', required=True, readonly=True)
+    direction = fields.Selection([
+        ('in', 'In'),
+        ('out', 'Out'),
+        ], 'Direction', required=True, readonly=True)
+    cash_bank = fields.Many2One('cash_bank.cash_bank', 'Cash/Bank',
+        required=True, readonly=True)
+    receipt = fields.Many2One('cash_bank.receipt', 'Receipt',
+        readonly=True, ondelete='SET NULL')
+    convertion = fields.Many2One('cash_bank.convertion', 'Convertion',
+        readonly=True, ondelete='SET NULL')
+
+    @classmethod
+    def __setup__(cls):
+        super(DocumentMovement, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.document, Index.Equality()),
+                (t.date, Index.Range())))
+        cls._order = [
+            ('date', 'DESC'),
+            ('id', 'DESC'),
+            ]
+
+    @classmethod
+    def add(cls, movements):
+        'Append the movements given as dictionaries'
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        columns = ['document', 'date', 'type', 'direction', 'cash_bank',
+            'receipt', 'convertion']
+        for sub_movements in grouped_slice(movements):
+            cursor.execute(*table.insert(
+                    columns=[Column(table, c) for c in columns]
+                    + [table.create_uid, table.create_date],
+                    values=[[m.get(c) for c in columns]
+                        + [transaction.user, CurrentTimestamp()]
+                        for m in sub_movements]))
+
+    @classmethod
+    def get_last_movements(cls, documents, date=None):
+        '''
+        Return the last movement of each document made on the date or
+        before, all movements are considered when no date is given
+        '''
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        result = {d.id: None for d in documents}
+        for sub_ids in grouped_slice(list(result)):
+            where = reduce_ids(table.document, sub_ids)
+            if date is not None:
+                where &= table.date <= date
+            if transaction.database.has_window_functions():
+                rank = RowNumber(window=Window([table.document],
+                        order_by=[table.date.desc, table.id.desc]))
+                query = table.select(
+                    table.document, table.id, rank.as_('rank'),
+                    where=where)
+                query = query.select(query.document, query.id,
+                    where=query.rank == 1)
+            else:
+                query = table.select(
+                    table.document, Max(table.id),
+                    where=where,
+                    group_by=[table.document])
+            cursor.execute(*query)
+            result.update(cursor)
+        return {d: cls(m) if m is not None else None
+            for d, m in result.items()}
+
+    @classmethod
+    def get_locations(cls, documents, date):
+        '''
+        Return the cash/bank holding each document at the end of the date
+        or None
+        '''
+        result = {}
+        for document_id, movement in cls.get_last_movements(
+                documents, date).items():
+            if movement and movement.direction == 'in':
+                result[document_id] = movement.cash_bank
+            else:
+                result[document_id] = None
+        return result
+
 
 class DocumentReceipt(ModelSQL):
     'Receipt - Document'
@@ -131,6 +402,19 @@ class DocumentReceipt(ModelSQL):
     receipt = fields.Many2One('cash_bank.receipt', 'Receipt',
         ondelete='CASCADE', required=True)
 
+    @classmethod
+    def __setup__(cls):
+        super(DocumentReceipt, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.receipt, Index.Equality()),
+                    (t.document, Index.Equality())),
+                Index(t,
+                    (t.document, Index.Equality()),
+                    (t.id, Index.Range())),
+                })
+
 
 class DocumentLog(LogActionMixin):
     "Document Logs"
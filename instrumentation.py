@@ -0,0 +1,169 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import cProfile
+import io
+import logging
+import pstats
+import time
+from contextlib import contextmanager
+from functools import wraps
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from .common import transaction_cache, buffered_logs
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter(object):
+    'Connection wrapper counting the executed SQL statements'
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.count = 0
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self, self._connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class _CountingCursor(object):
+
+    def __init__(self, counter, cursor):
+        self._counter = counter
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        self._counter.count += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter.count += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+@contextmanager
+def count_queries():
+    'Count the SQL statements executed by the current transaction'
+    transaction = Transaction()
+    connection = transaction.connection
+    counter = QueryCounter(connection)
+    transaction.connection = counter
+    try:
+        yield counter
+    finally:
+        transaction.connection = connection
+
+
+def _calls():
+    return transaction_cache('cash_bank.instrumentation').setdefault(
+        'calls', [])
+
+
+@contextmanager
+def span(name):
+    'Add the time spent in the block to the phase name of the current call'
+    calls = _calls()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if calls:
+            phases = calls[-1]
+            phases[name] = (phases.get(name, 0)
+                + time.perf_counter() - start)
+
+
+def instrumented(func):
+    '''
+    Decorate a workflow method to record the number of SQL statements
+    of its last call in the transaction and the time spent in its phases.
+    The timings are logged and stored when activated in the configuration
+    and calls slower than the configured threshold are stored even when
+    they fail.
+    The logs of the records are written at the end of the outermost call.
+    '''
+    @wraps(func)
+    def wrapper(cls, records, *args, **kwargs):
+        pool = Pool()
+        Config = pool.get('cash_bank.configuration')
+        Timing = pool.get('cash_bank.timing')
+        SlowOperation = pool.get('cash_bank.slow_operation')
+
+        calls = _calls()
+        name = '%s.%s' % (cls.__name__, func.__name__)
+        profiler = None
+        # Only one profiler can be active at a time
+        if not calls and Config.get_cached_multivalue('profile_workflow'):
+            profiler = cProfile.Profile()
+
+        phases = {}
+        calls.append(phases)
+        start = time.perf_counter()
+        succeeded = False
+        counter = None
+        try:
+            with count_queries() as counter, buffered_logs():
+                if profiler:
+                    profiler.enable()
+                try:
+                    result = func(cls, records, *args, **kwargs)
+                finally:
+                    if profiler:
+                        profiler.disable()
+            succeeded = True
+        finally:
+            calls.pop()
+            duration = time.perf_counter() - start
+            # Failing calls are recorded too
+            threshold = Config.get_cached_multivalue('slow_threshold')
+            if threshold and duration >= threshold:
+                logger.warning('%s of %s records is slow: %.3fs%s', name,
+                    len(records), duration, '' if succeeded else ' (failed)')
+                try:
+                    # The failing call rolls back its transaction
+                    SlowOperation.record(name, records, duration,
+                        counter.count if counter else None, phases,
+                        commit=not succeeded)
+                except Exception:
+                    if succeeded:
+                        raise
+                    # Do not hide the error of the call
+                    logger.exception('unable to record %s', name)
+
+        counts = transaction_cache('cash_bank.query_count')
+        counts[(cls.__name__, func.__name__)] = counter.count
+        logger.debug('%s of %s records in %.3fs with %s queries: %s',
+            name, len(records), duration, counter.count,
+            ', '.join('%s %.3fs' % p for p in phases.items()))
+        # Only the profiles of the slow calls are logged
+        if profiler and (not threshold or duration >= threshold):
+            _log_profile(name, profiler)
+        if Config.get_cached_multivalue('timing_statistics'):
+            Timing.record(name, duration, len(records), phases)
+        return result
+    return wrapper
+
+
+def _log_profile(name, profiler):
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats('cumulative').print_stats(50)
+    logger.info('profile of %s\n%s', name, output.getvalue())
+
+
+def get_query_count(model, name):
+    '''
+    Return the number of SQL statements of the last call to the method
+    name of model in the transaction
+    '''
+    counts = transaction_cache('cash_bank.query_count')
+    return counts.get((model.__name__, name))
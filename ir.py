@@ -0,0 +1,17 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+from trytond.pool import PoolMeta
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super(Cron, cls).__setup__()
+        cls.method.selection.append(
+            ('cash_bank.log_action.archive|archive',
+                "Archive Cash/Bank Logs"))
+        cls.method.selection.append(
+            ('cash_bank.timing|prune', "Prune Cash/Bank Timings"))
@@ -0,0 +1,146 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import datetime
+from trytond.config import config
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.model import ModelView, ModelSQL, fields, Index
+from trytond.tools import reduce_ids
+from sql import Literal, Null
+from sql.conditionals import Coalesce
+
+# Log model and resource model of the archived logs
+LOGS = [
+    ('cash_bank.receipt.log_action', 'cash_bank.receipt'),
+    ('cash_bank.document.log_action', 'cash_bank.document'),
+    ('cash_bank.transfer.log_action', 'cash_bank.transfer'),
+    ('cash_bank.convertion.log_action', 'cash_bank.convertion'),
+    ]
+
+
+class LogArchive(ModelSQL, ModelView):
+    "Cash/Bank Archived Log"
+    __name__ = 'cash_bank.log_action.archive'
+    company = fields.Many2One('company.company', 'Company', readonly=True)
+    resource_model = fields.Char('Resource Model', readonly=True)
+    resource_id = fields.Integer('Resource ID', readonly=True)
+    resource = fields.Function(fields.Reference('Resource',
+            selection='get_resource_models'), 'get_resource')
+    date = fields.DateTime('Date', readonly=True)
+    user = fields.Many2One('res.user', 'User', readonly=True)
+    action = fields.Char('Action', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(LogArchive, cls).__setup__()
+        t = cls.__table__()
+        cls._order = [
+            ('date', 'DESC'),
+            ('id', 'DESC'),
+            ]
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.resource_model, Index.Equality()),
+                    (t.resource_id, Index.Equality())),
+                })
+
+    @classmethod
+    def get_resource_models(cls):
+        pool = Pool()
+        Model = pool.get('ir.model')
+        return [(None, '')] + [(m, Model.get_name(m)) for _, m in LOGS]
+
+    def get_resource(self, name):
+        return '%s,%s' % (self.resource_model, self.resource_id)
+
+    @classmethod
+    def _resource_companies(cls, resource_model):
+        '''
+        Return a query with the id and company of the resources,
+        the company is NULL when it can not be found
+        '''
+        pool = Pool()
+        Resource = pool.get(resource_model)
+        table = Resource.__table__()
+        if resource_model == 'cash_bank.document':
+            Receipt = pool.get('cash_bank.receipt')
+            Convertion = pool.get('cash_bank.convertion')
+            receipt = Receipt.__table__()
+            convertion = Convertion.__table__()
+            # Documents without receipt take the company of their
+            # convertion
+            return table.join(receipt, 'LEFT',
+                condition=table.last_receipt == receipt.id
+                ).join(convertion, 'LEFT',
+                    condition=table.convertion == convertion.id
+                ).select(table.id,
+                    Coalesce(receipt.company, convertion.company).as_(
+                        'company'))
+        return table.select(table.id, table.company)
+
+    @classmethod
+    def archive(cls, commit=True):
+        '''
+        Move the logs older than the retention of each company to the
+        archive by chunks, committing each one if commit
+        '''
+        pool = Pool()
+        Company = pool.get('company.company')
+        Config = pool.get('cash_bank.configuration')
+
+        now = datetime.datetime.now()
+        # The resources without company are archived with the retention
+        # set without company
+        for company in Company.search([]) + [None]:
+            with Transaction().set_context(
+                    company=company.id if company else None):
+                days = Config.get_cached_multivalue('log_retention')
+            if not days:
+                continue
+            limit = now - datetime.timedelta(days=days)
+            for log_model, resource_model in LOGS:
+                cls._archive(log_model, resource_model, company, limit,
+                    commit)
+
+    @classmethod
+    def _archive(cls, log_model, resource_model, company, limit, commit):
+        pool = Pool()
+        Log = pool.get(log_model)
+        log = Log.__table__()
+        archive = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        chunk = config.getint('cash_bank', 'log_archive_chunk', default=1000)
+
+        resources = cls._resource_companies(resource_model)
+        if company:
+            where = resources.company == company.id
+        else:
+            where = resources.company == Null
+        while True:
+            cursor.execute(*log.join(resources,
+                    condition=log.resource == resources.id
+                    ).select(log.id,
+                    where=where & (log.date < limit),
+                    order_by=[log.id],
+                    limit=chunk))
+            ids = [i for i, in cursor]
+            if not ids:
+                break
+            cursor.execute(*archive.insert(
+                    columns=[
+                        archive.company, archive.resource_model,
+                        archive.resource_id, archive.date, archive.user,
+                        archive.action, archive.create_uid,
+                        archive.create_date],
+                    values=log.select(
+                        Literal(company.id if company else None),
+                        Literal(resource_model),
+                        log.resource, log.date, log.user,
+                        log.action, log.create_uid, log.create_date,
+                        where=reduce_ids(log.id, ids))))
+            cursor.execute(*log.delete(where=reduce_ids(log.id, ids)))
+            transaction.counter += 1
+            if commit:
+                transaction.commit()
@@ -1,19 +1,29 @@
 # This file is part of Cash & Bank module.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
+from trytond import backend
 from trytond.transaction import Transaction
 from trytond.pool import Pool
 from trytond.model import (
-    sequence_ordered, Workflow, ModelView, ModelSQL, fields, Check)
+    sequence_ordered, Workflow, ModelView, ModelSQL, fields, Check, Index)
 from trytond.pyson import Eval, If, Bool, Not, And, Or, In
 from trytond.modules.log_action import LogActionMixin, write_log
 from trytond.i18n import gettext
 from trytond.exceptions import UserError
-from sql import Null
+from trytond.tools import reduce_ids, grouped_slice
+from .common import (
+    find_period, compute_currency, get_sequence_numbers, queue_workflow,
+    get_company_currency, add_log, invalidate_records)
+from .instrumentation import instrumented, span
+from sql import Null, Literal
+from sql.aggregate import Max, Sum
+from sql.conditionals import Case, Coalesce
+from sql.functions import CurrentTimestamp
+from sql.operators import Exists
+from collections import defaultdict
 from decimal import Decimal
 
 #TODO Use Monetary
-# CAche total for tree displaying
 
 class Receipt(Workflow, ModelSQL, ModelView):
     "Cash/Bank Receipt"
@@ -52,11 +62,11 @@ class Receipt(Workflow, ModelSQL, ModelView):
             'readonly': Bool(Eval('lines')) | Bool(Eval('state') != 'draft')
         }, depends=_depends + ['cash_bank', 'lines'])
     type_type = fields.Function(fields.Char('Type of Cash/Bank type',
-        size=None), 'on_change_with_type_type')
+        size=None), 'get_type_fields')
     currency = fields.Many2One('currency.currency', 'Currency', required=True,
         states={'readonly': True})
     currency_digits = fields.Function(fields.Integer('Currency Digits'),
-        'on_change_with_currency_digits')
+        'get_currency_digits')
     number = fields.Char('Number', size=None, readonly=True)
     reference = fields.Char('Reference', size=None)
     description = fields.Char('Description', size=None,
@@ -69,7 +79,7 @@ class Receipt(Workflow, ModelSQL, ModelView):
             'required': Bool(Eval('party_required'))
         }, depends=_depends + ['party_required'])
     party_required = fields.Function(fields.Boolean('Party Required'),
-        'on_change_with_party_required')
+        'get_type_fields')
     bank_account = fields.Many2One('bank.account', 'Bank Account',
         states={
             'readonly': Eval('state') != 'draft',
@@ -81,14 +91,14 @@ class Receipt(Workflow, ModelSQL, ModelView):
         ], depends=_depends + ['party', 'bank_account_show',
             'bank_account_owners', 'bank_account_required'])
     bank_account_show = fields.Function(fields.Boolean('Bank Account Show'),
-        'on_change_with_bank_account_show')
+        'get_type_fields')
     bank_account_owners = fields.Function(fields.One2Many('bank.account',
         None, 'Bank Account Owners'),
-        'on_change_with_bank_account_owners',
+        'get_bank_account_owners',
         setter='set_bank_account_owners')
     bank_account_required = fields.Function(fields.Boolean(
         'Bank Account Required'),
-        'on_change_with_bank_account_required')
+        'get_type_fields')
     cash = fields.Numeric('Cash',
         digits=(16, Eval('currency_digits', 2)),
         states=_states, depends=_depends + ['currency_digits'])
@@ -102,16 +112,12 @@ class Receipt(Workflow, ModelSQL, ModelView):
                         If(Eval('type_type') == 'in',
                             ['OR',
                                 [('last_receipt', '=', None)],
-                                [('last_receipt.id', '=', Eval('id'))],
-                                [('last_receipt.type.type', '=', 'out')]
+                                [('last_receipt', '=', Eval('id'))],
+                                [('status', '=', 'paid_out')]
                             ],
                             ['OR',
-                                [('last_receipt.id', '=', Eval('id'))],
-                                [
-                                    ('last_receipt.type.type', '=', 'in'),
-                                    ('last_receipt.state', 'in',
-                                        ['confirmed', 'posted'])
-                                ]
+                                [('last_receipt', '=', Eval('id'))],
+                                [('status', '=', 'in_hand')]
                             ],
                         ),
                         [('id', '=', -1)]
@@ -122,10 +128,9 @@ class Receipt(Workflow, ModelSQL, ModelView):
         ],
         states=_states,
         depends=_depends + ['id', 'type', 'type_type'])
-    total_documents = fields.Function(fields.Numeric('Total Documents',
+    total_documents = fields.Numeric('Total Documents', readonly=True,
         digits=(16, Eval('currency_digits', 2)),
-        depends=['currency_digits']),
-        'get_total_detail')
+        depends=['currency_digits'])
     document_allow = fields.Function(fields.Boolean('Allow documents'),
         'on_change_with_document_allow')
     lines = fields.One2Many('cash_bank.receipt.line', 'receipt',
@@ -135,18 +140,15 @@ class Receipt(Workflow, ModelSQL, ModelView):
                             | Bool(Eval('state') != 'draft'))
         },
         depends=_depends + ['cash_bank', 'type'])
-    total_lines = fields.Function(fields.Numeric('Total Lines',
+    total_lines = fields.Numeric('Total Lines', readonly=True,
         digits=(16, Eval('currency_digits', 2)),
-        depends=['currency_digits']),
-        'get_total_detail')
-    total = fields.Function(fields.Numeric('Total',
+        depends=['currency_digits'])
+    total = fields.Numeric('Total', readonly=True,
         digits=(16, Eval('currency_digits', 2)),
-        depends=['currency_digits']),
-        'get_total')
-    diff = fields.Function(fields.Numeric('Diff',
+        depends=['currency_digits'])
+    diff = fields.Numeric('Diff', readonly=True,
         digits=(16, Eval('currency_digits', 2)),
-        depends=['currency_digits']),
-        'get_diff')
+        depends=['currency_digits'])
     move = fields.Many2One('account.move', 'Move', readonly=True,
         domain=[
             ('company', '=', Eval('company', -1)),
@@ -170,6 +172,13 @@ class Receipt(Workflow, ModelSQL, ModelView):
 
     @classmethod
     def __register__(cls, module_name):
+        Line = Pool().get('cash_bank.receipt.line')
+        # The receipt table may be created by a foreign key before the
+        # lines on a new database, the totals are then all zero
+        fill_totals = (backend.TableHandler.table_exist(cls._table)
+            and backend.TableHandler.table_exist(Line._table)
+            and not cls.__table_handler__(module_name).column_exist('total'))
+
         super(Receipt, cls).__register__(module_name)
         table = cls.__table_handler__(module_name)
         # Migration from 5.2.1:
@@ -180,6 +189,10 @@ class Receipt(Workflow, ModelSQL, ModelView):
             table.drop_column('posted_by')
             table.drop_column('canceled_by')
 
+        # Migration from 6.6.0: totals are stored
+        if fill_totals:
+            cls.update_totals()
+
     @classmethod
     def _migrate_log(cls):
         def add_log(Log, User, receipt, user, action, logs, create=False):
@@ -220,10 +233,21 @@ class Receipt(Workflow, ModelSQL, ModelView):
     @classmethod
     def __setup__(cls):
         super(Receipt, cls).__setup__()
+        t = cls.__table__()
         cls._order = [
                 ('date', 'DESC'),
                 ('number', 'DESC'),
                 ]
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.cash_bank, Index.Equality()),
+                    (t.state, Index.Equality()),
+                    (t.date, Index.Range())),
+                Index(t, (t.number, Index.Similarity())),
+                Index(t, (t.party, Index.Equality())),
+                Index(t, (t.transfer, Index.Equality()),
+                    where=t.transfer != Null),
+                })
 
         cls._transitions |= set(
             (
@@ -283,20 +307,11 @@ class Receipt(Workflow, ModelSQL, ModelView):
 
     @staticmethod
     def default_currency():
-        Company = Pool().get('company.company')
-        company = Transaction().context.get('company')
-        if company:
-            company = Company(company)
-            return company.currency.id
+        return get_company_currency()[0]
 
     @staticmethod
     def default_currency_digits():
-        Company = Pool().get('company.company')
-        company = Transaction().context.get('company')
-        if company:
-            company = Company(company)
-            return company.currency.digits
-        return 2
+        return get_company_currency()[1]
 
     @fields.depends('currency')
     def on_change_with_currency_digits(self, name=None):
@@ -349,6 +364,79 @@ class Receipt(Workflow, ModelSQL, ModelView):
     def set_bank_account_owners(cls, lines, name, value):
         pass
 
+    @classmethod
+    def get_currency_digits(cls, receipts, name):
+        pool = Pool()
+        Currency = pool.get('currency.currency')
+        table = cls.__table__()
+        currency = Currency.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {r.id: 2 for r in receipts}
+        for sub_ids in grouped_slice(list(result)):
+            cursor.execute(*table.join(currency,
+                    condition=table.currency == currency.id
+                    ).select(table.id, currency.digits,
+                    where=reduce_ids(table.id, sub_ids)))
+            result.update(cursor)
+        return result
+
+    @classmethod
+    def get_type_fields(cls, receipts, names):
+        'Compute the Function fields of the type of receipts like on_change'
+        pool = Pool()
+        ReceiptType = pool.get('cash_bank.receipt_type')
+        table = cls.__table__()
+        receipt_type = ReceiptType.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {n: {r.id: None for r in receipts} for n in names}
+        for sub_ids in grouped_slice([r.id for r in receipts]):
+            cursor.execute(*table.join(receipt_type,
+                    condition=table.type == receipt_type.id
+                    ).select(
+                        table.id, receipt_type.type,
+                        receipt_type.party_required,
+                        receipt_type.bank_account,
+                        receipt_type.bank_account_required,
+                        where=reduce_ids(table.id, sub_ids)))
+            for (receipt_id, type_, party_required, bank_account,
+                    bank_account_required) in cursor:
+                values = {
+                    'type_type': type_,
+                    'party_required': bool(party_required),
+                    'bank_account_show': None,
+                    'bank_account_required': None,
+                    }
+                if party_required:
+                    values['bank_account_show'] = bool(bank_account)
+                    if bank_account:
+                        values['bank_account_required'] = bool(
+                            bank_account_required)
+                for name in names:
+                    result[name][receipt_id] = values[name]
+        return result
+
+    @classmethod
+    def get_bank_account_owners(cls, receipts, name):
+        pool = Pool()
+        AccountOwner = pool.get('bank.account-party.party')
+        table = cls.__table__()
+        owner = AccountOwner.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {r.id: [] for r in receipts}
+        for sub_ids in grouped_slice(list(result)):
+            cursor.execute(*table.join(owner,
+                    condition=table.party == owner.owner
+                    ).select(table.id, owner.account,
+                    where=reduce_ids(table.id, sub_ids)
+                    & (table.type != Null),
+                    order_by=[table.id, owner.id]))
+            for receipt_id, account_id in cursor:
+                result[receipt_id].append(account_id)
+        return result
+
     @fields.depends()
     def on_change_company(self):
         self.cash_bank = None
@@ -389,13 +477,6 @@ class Receipt(Workflow, ModelSQL, ModelView):
         total = self._get_total_details(getattr(self, name))
         return total
 
-    def get_total(self, name=None):
-        total = self.cash + self.total_documents
-        return total
-
-    def get_diff(self, name=None):
-        return self.total_lines - self.total
-
     def get_rec_name(self, name):
         if self.number:
             return self.number
@@ -435,11 +516,12 @@ class Receipt(Workflow, ModelSQL, ModelView):
         'Return Move for Receipt'
         pool = Pool()
         Move = pool.get('account.move')
-        Period = pool.get('account.period')
-        period_id = Period.find(self.company.id, date=self.date)
+        CashBank = pool.get('cash_bank.cash_bank')
+        period_id = find_period(self.company, self.date)
         move = Move(
             period=period_id,
-            journal=self.cash_bank.journal_cash_bank,
+            journal=CashBank.get_metadata(
+                self.cash_bank)['journal_cash_bank'],
             date=self.date,
             origin=self,
             company=self.company,
@@ -450,13 +532,13 @@ class Receipt(Workflow, ModelSQL, ModelView):
     def _get_move_line(self, period):
         pool = Pool()
         MoveLine = pool.get('account.move.line')
-        Currency = pool.get('currency.currency')
+        CashBank = pool.get('cash_bank.cash_bank')
+        ReceiptType = pool.get('cash_bank.receipt_type')
         debit = Decimal('0.0')
         credit = Decimal('0.0')
 
-        with Transaction().set_context(date=self.date):
-            amount = Currency.compute(self.currency,
-                self.total, self.company.currency)
+        amount = compute_currency(self.currency,
+            self.total, self.company.currency, self.date)
         if self.currency != self.company.currency:
             second_currency = self.currency
             amount_second_currency = self.total
@@ -464,7 +546,7 @@ class Receipt(Workflow, ModelSQL, ModelView):
             amount_second_currency = None
             second_currency = None
 
-        if self.type.type == 'in':
+        if ReceiptType.get_metadata(self.type)['type'] == 'in':
             debit = amount
         else:
             credit = amount
@@ -479,32 +561,127 @@ class Receipt(Workflow, ModelSQL, ModelView):
             period=period,
             debit=debit,
             credit=credit,
-            account=self.cash_bank.account,
+            account=CashBank.get_metadata(self.cash_bank)['account'],
             second_currency=second_currency,
             amount_second_currency=amount_second_currency,
             description=description,
             )
 
+    @classmethod
+    def update_totals(cls, receipts=None):
+        '''
+        Store totals computed from lines, documents and cash.
+        All receipts are updated if receipts is None.
+        '''
+        pool = Pool()
+        Line = pool.get('cash_bank.receipt.line')
+        Document = pool.get('cash_bank.document')
+        DocumentReceipt = pool.get('cash_bank.document-cash_bank.receipt')
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        def update(where=None):
+            receipt = cls.__table__()
+            line = Line.__table__()
+            document = Document.__table__()
+            relation = DocumentReceipt.__table__()
+            if where is None:
+                where_line = where_relation = where_receipt = Literal(True)
+            else:
+                where_line = where(line.receipt)
+                where_relation = where(relation.receipt)
+                where_receipt = where(receipt.id)
+
+            lines = line.select(
+                line.receipt,
+                Sum(line.amount).as_('amount'),
+                where=where_line,
+                group_by=line.receipt)
+            documents = relation.join(document,
+                condition=relation.document == document.id
+                ).select(
+                    relation.receipt,
+                    Sum(document.amount).as_('amount'),
+                    where=where_relation,
+                    group_by=relation.receipt)
+            total_lines = Coalesce(lines.amount, 0)
+            total_documents = Coalesce(documents.amount, 0)
+            total = Coalesce(receipt.cash, 0) + total_documents
+            totals = receipt.join(lines, 'LEFT',
+                condition=lines.receipt == receipt.id
+                ).join(documents, 'LEFT',
+                    condition=documents.receipt == receipt.id
+                ).select(
+                    receipt.id.as_('receipt'),
+                    total_lines.as_('total_lines'),
+                    total_documents.as_('total_documents'),
+                    total.as_('total'),
+                    (total_lines - total).as_('diff'),
+                    where=where_receipt)
+            cursor.execute(*table.update(
+                    columns=[
+                        table.total_lines, table.total_documents,
+                        table.total, table.diff],
+                    values=[
+                        totals.total_lines, totals.total_documents,
+                        totals.total, totals.diff],
+                    from_=[totals],
+                    where=table.id == totals.receipt))
+
+        if receipts is None:
+            ids = None
+            update()
+        else:
+            ids = list({r.id for r in receipts})
+            for sub_ids in grouped_slice(ids):
+                sub_ids = list(sub_ids)
+                update(lambda column: reduce_ids(column, sub_ids))
+        invalidate_records(cls.__name__, ids)
+
     @classmethod
     def create(cls, vlist):
         receipts = super(Receipt, cls).create(vlist)
-        write_log('log_action.msg_created', receipts)
+        cls.update_totals(receipts)
+        # Only receipts created with documents need to be linked
+        with span('set_document_receipt'):
+            cls.set_document_receipt([r for r, v in zip(receipts, vlist)
+                    if v.get('documents')])
+        add_log('log_action.msg_created', receipts)
         return receipts
 
     @classmethod
-    def validate(cls, receipts):
-        super(Receipt, cls).validate(receipts)
-        cls.set_document_receipt(receipts)
+    def write(cls, *args):
+        Document = Pool().get('cash_bank.document')
+        super(Receipt, cls).write(*args)
+        to_update = []
+        to_link = []
+        to_status = []
+        actions = iter(args)
+        for receipts, values in zip(actions, actions):
+            if values.keys() & {'cash', 'lines', 'documents'}:
+                to_update.extend(receipts)
+            if 'documents' in values:
+                to_link.extend(receipts)
+            if values.keys() & {'state', 'type', 'cash_bank'}:
+                to_status.extend(receipts)
+        if to_update:
+            cls.update_totals(to_update)
+        if to_status:
+            Document.update_status(receipts=to_status)
+        if to_link:
+            with span('set_document_receipt'):
+                cls.set_document_receipt(to_link)
 
     @classmethod
     def _validate_receipt(cls, receipt):
         pool = Pool()
         Config = pool.get('cash_bank.configuration')
+        ReceiptType = pool.get('cash_bank.receipt_type')
 
-        config = Config(1)
-
-        if config.month_allow:
-            month = int(config.month_allow)
+        month_allow = Config.get_cached_multivalue('month_allow')
+        if month_allow:
+            month = int(month_allow)
             if month != receipt.date.month:
                 raise UserError(
                     gettext('cash_bank.msg_receipt_month_not_allow',
@@ -532,52 +709,134 @@ class Receipt(Workflow, ModelSQL, ModelView):
                 raise UserError(
                     gettext('cash_bank.msg_document_less_equal_zero'
                     ))
-        if receipt.type.party_required and not receipt.party:
+        if (ReceiptType.get_metadata(receipt.type)['party_required']
+                and not receipt.party):
             raise UserError(
                 gettext('cash_bank.msg_party_required_cash_bank'
                 ))
 
     @classmethod
     def set_document_receipt(cls, receipts):
-        def doc_exists(id_, docs):
-            for dc in docs:
-                if dc.id == id_:
-                    return True
+        if not receipts:
+            return
+        pool = Pool()
+        Document = pool.get('cash_bank.document')
+        DocumentReceipt = pool.get('cash_bank.document-cash_bank.receipt')
+        document = Document.__table__()
+        relation = DocumentReceipt.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        receipts = {r.id: r for r in receipts}
+        assigned = defaultdict(list)
+        removed = []
+        # A document in several receipts of the batch is assigned to the
+        # last one created
+        for sub_ids in grouped_slice(sorted(receipts)):
+            sub_ids = list(sub_ids)
+            to_assign = relation.select(
+                relation.document, Max(relation.receipt).as_('receipt'),
+                where=reduce_ids(relation.receipt, sub_ids),
+                group_by=[relation.document])
+            where = ((document.last_receipt == Null)
+                | (document.last_receipt != to_assign.receipt))
+            cursor.execute(*to_assign.join(document,
+                    condition=to_assign.document == document.id
+                    ).select(to_assign.receipt, to_assign.document,
+                        where=where))
+            for receipt_id, document_id in cursor:
+                assigned[receipt_id].append(document_id)
+            cursor.execute(*document.update(
+                    columns=[
+                        document.last_receipt,
+                        document.write_uid, document.write_date],
+                    values=[
+                        to_assign.receipt,
+                        transaction.user, CurrentTimestamp()],
+                    from_=[to_assign],
+                    where=(document.id == to_assign.document) & where))
+
+            # Documents deleted from the list must return to their
+            # previous receipt
+            cursor.execute(*document.select(document.id,
+                    where=reduce_ids(document.last_receipt, sub_ids)
+                    & ~Exists(relation.select(relation.id,
+                            where=(relation.document == document.id)
+                            & (relation.receipt == document.last_receipt)
+                            ))))
+            removed.extend(r for r, in cursor)
+        transaction.counter += 1
+        Document.update_status(
+            Document.browse([d for ds in assigned.values() for d in ds]))
+
+        if removed:
+            Document.set_previous_receipts(Document.browse(removed))
+
+        for receipt_id, document_ids in assigned.items():
+            receipt = receipts[receipt_id]
+            if receipt.transfer and \
+                    receipt.transfer.state in ['confirmed', 'post']:
+                continue
+            add_log('Asigned to Receipt: ' + receipt.rec_name,
+                Document.browse(document_ids))
 
-        Document = Pool().get('cash_bank.document')
+    @classmethod
+    def _update_balances(cls, receipts, amount=0, posted=0):
+        'Add the moves of receipts multiplied by the factors to the balances'
+        Balance = Pool().get('cash_bank.balance')
+        deltas = defaultdict(lambda: [Decimal('0.0'), Decimal('0.0')])
+        for receipt in receipts:
+            if not receipt.line_move:
+                continue
+            value = receipt.line_move.debit - receipt.line_move.credit
+            delta = deltas[(receipt.cash_bank.id, receipt.date)]
+            delta[0] += value * amount
+            delta[1] += value * posted
+        Balance.apply(deltas)
 
-        lasts = {}
+    @classmethod
+    def _add_document_movements(cls, receipts, reverse=False):
+        'Append the movements of the documents of receipts'
+        pool = Pool()
+        Movement = pool.get('cash_bank.document.movement')
+        ReceiptType = pool.get('cash_bank.receipt_type')
+        movements = []
         for receipt in receipts:
-            for doc in receipt.documents:
-                if doc.last_receipt != receipt:
-                    doc.last_receipt = receipt
-                    doc.save()
-                    if receipt.transfer and \
-                            receipt.transfer.state in ['confirmed', 'post']:
-                        pass
-                    else:
-                        if receipt.rec_name not in lasts:
-                            lasts[receipt.rec_name] = []
-                        lasts[receipt.rec_name].append(doc)
-
-            # Verify if any document have been deleted from list
-            # so last_receipt must be updated
-            documents = Document.search([
-                ('last_receipt', '=', receipt.id)])
-            for doc in documents:
-                if not doc_exists(doc.id, receipt.documents):
-                    doc.set_previous_receipt()
-                    doc.save()
-
-        for key, value in lasts.items():
-            write_log('Asigned to Receipt: ' + key, value)
+            if ReceiptType.get_metadata(receipt.type)['type'] == 'in':
+                type_, direction = 'entry', 'in'
+            else:
+                type_, direction = 'exit', 'out'
+            if receipt.transfer:
+                type_ = 'transfer'
+            if reverse:
+                direction = 'out' if direction == 'in' else 'in'
+            for document in receipt.documents:
+                movements.append({
+                        'document': document.id,
+                        'date': receipt.date,
+                        'type': type_,
+                        'direction': direction,
+                        'cash_bank': receipt.cash_bank.id,
+                        'receipt': receipt.id,
+                        })
+        Movement.add(movements)
 
     @classmethod
     def set_number(cls, receipts):
+        pool = Pool()
+        Sequence = pool.get('ir.sequence')
+        ReceiptType = pool.get('cash_bank.receipt_type')
+        to_number = defaultdict(list)
         for receipt in receipts:
             if receipt.number:
                 continue
-            receipt.number = receipt.type.sequence.get()
+            sequence = ReceiptType.get_metadata(receipt.type)['sequence']
+            to_number[sequence].append(receipt)
+        for sequence, sequence_receipts in to_number.items():
+            numbers = get_sequence_numbers(
+                Sequence(sequence), len(sequence_receipts))
+            for receipt, number in zip(sequence_receipts, numbers):
+                receipt.number = number
         cls.save(receipts)
 
     @classmethod
@@ -604,8 +863,10 @@ class Receipt(Workflow, ModelSQL, ModelView):
     def delete(cls, receipts):
         pool = Pool()
         Attachment = pool.get('ir.attachment')
+        Document = pool.get('cash_bank.document')
 
         atts = []
+        documents = []
         for receipt in receipts:
             if receipt.state not in ['draft']:
                 write_log('log_action.msg_deletion_attempt', [receipt])
@@ -615,83 +876,132 @@ class Receipt(Workflow, ModelSQL, ModelView):
                         doc_number=receipt.rec_name,
                         state='Draft'
                     ))
-            for doc in receipt.documents:
-                doc.set_previous_receipt()
-                doc.save()
+            documents.extend(receipt.documents)
             for att in receipt.attachments:
                 atts.append(att)
 
+        Document.set_previous_receipts(documents,
+            exclude=[r.id for r in receipts])
         Attachment.delete(atts)
         super(Receipt, cls).delete(receipts)
 
     @classmethod
+    @instrumented
     @ModelView.button
     @Workflow.transition('draft')
     def draft(cls, receipts):
-        write_log('log_action.msg_draft', receipts)
+        add_log('log_action.msg_draft', receipts)
 
     @classmethod
+    @queue_workflow
+    @instrumented
     @ModelView.button
     @Workflow.transition('confirmed')
     def confirm(cls, receipts):
+        pool = Pool()
+        Move = pool.get('account.move')
+        MoveLine = pool.get('account.move.line')
+        Line = pool.get('cash_bank.receipt.line')
+
+        moves = []
+        move_lines = []
+        line_moves = []
         for receipt in receipts:
-            cls._validate_receipt(receipt)
-
-            move, period = receipt._get_move()
-            move.save()
-            receipt_line_move = receipt._get_move_line(period)
-            receipt_line_move.move = move
-            receipt_line_move.save()
-            move_lines = [receipt_line_move]
+            with span('validate'):
+                cls._validate_receipt(receipt)
+
+            with span('moves'):
+                move, period = receipt._get_move()
+                receipt.move = move
+                receipt.line_move = receipt._get_move_line(period)
+                receipt.line_move.move = move
+            moves.append(move)
+            move_lines.append(receipt.line_move)
             for line in receipt.lines:
-                line.validate_line()
-                move_line = line.get_move_line(period)
-                move_line.move = move
-                move_line.save()
-                line.line_move = move_line
-                line.save()
+                with span('validate_line'):
+                    line.validate_line()
+                with span('moves'):
+                    move_line = line.get_move_line(period)
+                    move_line.move = move
                 move_lines.append(move_line)
-            move.lines = move_lines
-            move.save()
-
-            receipt.move = move
-            receipt.line_move = receipt_line_move
-            receipt.save()
-
-        cls.set_number(receipts)
-        write_log('log_action.msg_confirmed', receipts)
+                line_moves.append((line, move_line))
+
+        with span('save'):
+            # The move lines are created after their moves to get their ids
+            Move.save(moves)
+            MoveLine.save(move_lines)
+            Line.set_line_moves({l.id: m.id for l, m in line_moves})
+
+        with span('set_number'):
+            cls.set_number(receipts)
+        with span('balance'):
+            cls._update_balances(receipts, amount=1)
+        with span('document_movements'):
+            cls._add_document_movements(receipts)
+        with span('log'):
+            add_log('log_action.msg_confirmed', receipts)
 
     @classmethod
+    @queue_workflow
+    @instrumented
     @ModelView.button
     @Workflow.transition('posted')
     def post(cls, receipts):
-        Move = Pool().get('account.move')
-
-        for receipt in receipts:
-            cls._validate_receipt(receipt)
-            for line in receipt.lines:
-                line.reconcile()
+        pool = Pool()
+        Move = pool.get('account.move')
+        Line = pool.get('cash_bank.receipt.line')
 
-        Move.post([r.move for r in receipts])
-        write_log('log_action.msg_posted', receipts)
+        lines = []
+        with span('validate'):
+            for receipt in receipts:
+                cls._validate_receipt(receipt)
+                lines.extend(receipt.lines)
+        with span('reconcile'):
+            Line.reconcile_lines(lines)
+
+        with span('post_moves'):
+            Move.post([r.move for r in receipts])
+        with span('balance'):
+            cls._update_balances(receipts, posted=1)
+        with span('log'):
+            add_log('log_action.msg_posted', receipts)
 
     @classmethod
+    @instrumented
     @ModelView.button
     @Workflow.transition('cancel')
     def cancel(cls, receipts):
         pool = Pool()
         Move = pool.get('account.move')
         Line = pool.get('cash_bank.receipt.line')
-        lines_to_del = []
-        for receipt in receipts:
-            for line in receipt.lines:
-                # It is necessary if invoice has been paid
-                # in any other process
-                if line.invoice and line.invoice.state != 'posted':
-                    lines_to_del.append(line)
-        Line.delete(lines_to_del)
-        Move.delete([r.move for r in receipts])
-        write_log('log_action.msg_cancelled', receipts)
+        Invoice = pool.get('account.invoice')
+        line = Line.__table__()
+        invoice = Invoice.__table__()
+        cursor = Transaction().connection.cursor()
+
+        # Browse the receipts together to read their relations per batch
+        receipts = cls.browse(receipts)
+        with span('lines'):
+            # It is necessary if invoice has been paid
+            # in any other process
+            line_ids = []
+            for sub_ids in grouped_slice([r.id for r in receipts]):
+                cursor.execute(*line.join(invoice,
+                        condition=line.invoice == invoice.id
+                        ).select(line.id,
+                        where=reduce_ids(line.receipt, sub_ids)
+                        & (invoice.state != 'posted')))
+                line_ids.extend(i for i, in cursor)
+            if line_ids:
+                Line.delete(Line.browse(line_ids))
+        with span('balance'):
+            cls._update_balances(receipts, amount=-1)
+        with span('document_movements'):
+            cls._add_document_movements(receipts, reverse=True)
+        with span('moves'):
+            Move.delete(Move.browse([r.move.id for r in receipts if r.move]))
+        with span('log'):
+            add_log('log_action.msg_cancelled', receipts)
 
 
 class Line(sequence_ordered(), ModelSQL, ModelView):
@@ -707,10 +1017,10 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
         required=True, ondelete='CASCADE')
     currency = fields.Function(
         fields.Many2One('currency.currency', 'Currency'),
-        'on_change_with_currency')
+        'get_receipt_fields')
     currency_digits = fields.Function(
         fields.Integer('Currency Digits'),
-        'on_change_with_currency_digits')
+        'get_receipt_fields')
     type = fields.Selection([
         (None, ''),
         ('invoice_customer', 'Customer Invoice'),
@@ -748,7 +1058,7 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
                 )
         }, depends=_depends + ['type'])
     party_required = fields.Function(fields.Boolean('Party Required'),
-        'on_change_with_party_required')
+        'get_party_required')
     description = fields.Char('Description', states=_states,
         depends=_depends)
     invoice = fields.Many2One('account.invoice', 'Invoice',
@@ -776,7 +1086,7 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
             readonly=True)
     receipt_state = fields.Function(
         fields.Selection('get_receipt_states', 'Receipt State'),
-        'on_change_with_receipt_state')
+        'get_receipt_fields')
 
     del _states, _depends
 
@@ -833,6 +1143,15 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
             ('check_receipt_line_amount', Check(t, t.amount != 0),
                 'cash_bank.msg_line_amount_zero'),
             ]
+        cls._sql_indexes.update({
+                Index(t, (t.receipt, Index.Equality())),
+                Index(t, (t.invoice, Index.Equality()),
+                    where=t.invoice != Null),
+                Index(t, (t.line_move, Index.Equality()),
+                    where=t.line_move != Null),
+                })
+        # Selections of the receipt states per language
+        cls._receipt_states = {}
 
     @fields.depends('receipt', '_parent_receipt.state')
     def on_change_with_receipt_state(self, name=None):
@@ -885,6 +1204,57 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
         if self.account:
             return self.account.party_required
 
+    @classmethod
+    def get_receipt_fields(cls, lines, names):
+        'Compute the Function fields of the receipt of lines like on_change'
+        pool = Pool()
+        Receipt = pool.get('cash_bank.receipt')
+        Currency = pool.get('currency.currency')
+        table = cls.__table__()
+        receipt = Receipt.__table__()
+        currency = Currency.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {n: {l.id: None for l in lines} for n in names}
+        if 'currency_digits' in result:
+            result['currency_digits'] = {l.id: 2 for l in lines}
+        for sub_ids in grouped_slice([l.id for l in lines]):
+            cursor.execute(*table.join(receipt,
+                    condition=table.receipt == receipt.id
+                    ).join(currency,
+                    condition=receipt.currency == currency.id
+                    ).select(
+                        table.id, receipt.currency, currency.digits,
+                        receipt.state,
+                        where=reduce_ids(table.id, sub_ids)))
+            for line_id, currency_id, digits, state in cursor:
+                values = {
+                    'currency': currency_id,
+                    'currency_digits': digits,
+                    'receipt_state': state,
+                    }
+                for name in names:
+                    result[name][line_id] = values[name]
+        return result
+
+    @classmethod
+    def get_party_required(cls, lines, name):
+        pool = Pool()
+        Account = pool.get('account.account')
+        table = cls.__table__()
+        account = Account.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {l.id: None for l in lines}
+        for sub_ids in grouped_slice(list(result)):
+            cursor.execute(*table.join(account,
+                    condition=table.account == account.id
+                    ).select(table.id, account.party_required,
+                    where=reduce_ids(table.id, sub_ids)))
+            for line_id, party_required in cursor:
+                result[line_id] = bool(party_required)
+        return result
+
     def get_rec_name(self, name):
         return str(self.id) + '@' + self.receipt.rec_name
 
@@ -902,18 +1272,69 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
         default.setdefault('invoice', None)
         return super().copy(lines, default=default)
 
+    @classmethod
+    def create(cls, vlist):
+        Receipt = Pool().get('cash_bank.receipt')
+        lines = super(Line, cls).create(vlist)
+        Receipt.update_totals([l.receipt for l in lines])
+        return lines
+
+    @classmethod
+    def write(cls, *args):
+        Receipt = Pool().get('cash_bank.receipt')
+        receipts = []
+        actions = iter(args)
+        for lines, values in zip(actions, actions):
+            if values.keys() & {'amount', 'receipt'}:
+                receipts.extend(l.receipt for l in lines)
+            if values.get('receipt'):
+                receipts.append(Receipt(values['receipt']))
+        super(Line, cls).write(*args)
+        if receipts:
+            Receipt.update_totals(receipts)
+
+    @classmethod
+    def set_line_moves(cls, line_moves):
+        'Link the lines to their move line from the dictionary of ids'
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        ids = list(line_moves)
+        for sub_ids in grouped_slice(ids):
+            sub_ids = list(sub_ids)
+            cursor.execute(*table.update(
+                    columns=[
+                        table.line_move,
+                        table.write_uid, table.write_date],
+                    values=[
+                        Case(*((table.id == i, line_moves[i])
+                                for i in sub_ids)),
+                        transaction.user, CurrentTimestamp()],
+                    where=reduce_ids(table.id, sub_ids)))
+        invalidate_records(cls.__name__, ids)
+
+    @classmethod
+    def delete(cls, lines):
+        Receipt = Pool().get('cash_bank.receipt')
+        receipts = [l.receipt for l in lines]
+        super(Line, cls).delete(lines)
+        Receipt.update_totals(receipts)
+
     @classmethod
     def get_receipt_states(cls):
         pool = Pool()
         Receipt = pool.get('cash_bank.receipt')
-        return Receipt.fields_get(['state'])['state']['selection']
+        language = Transaction().language
+        if language not in cls._receipt_states:
+            cls._receipt_states[language] = Receipt.fields_get(
+                ['state'])['state']['selection']
+        return cls._receipt_states[language]
 
     def _format_amount(self, amount):
         pool = Pool()
         Lang = pool.get('ir.lang')
-        lang, = Lang.search([
-                ('code', '=', Transaction().language),
-                ])
+        lang = Lang.get()
         amount = Lang.format(lang,
             '%.' + str(self.receipt.currency.digits) + 'f',
             amount, True)
@@ -943,19 +1364,15 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
                             ))
 
     def validate_line(self):
-        pool = Pool()
-        Currency = pool.get('currency.currency')
-
         if self.amount == 0:
             raise UserError(
                 gettext('cash_bank.msg_line_amount_zero',
                         ))
 
         if self.invoice:
-            with Transaction().set_context(date=self.invoice.currency_date):
-                amount_to_pay = Currency.compute(self.invoice.currency,
-                    self.invoice.amount_to_pay,
-                    self.receipt.currency)
+            amount_to_pay = compute_currency(self.invoice.currency,
+                self.invoice.amount_to_pay,
+                self.receipt.currency, self.invoice.currency_date)
 
             if self.receipt.type.type == 'in':
                 if self.invoice.type == 'in':
@@ -966,38 +1383,62 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
             self._check_invalid_amount(amount_to_pay, self.invoice.rec_name)
 
     def reconcile(self):
+        self.reconcile_lines([self])
+
+    @classmethod
+    def reconcile_lines(cls, lines):
+        '''
+        Add the move lines as payment of their invoices and reconcile
+        the invoices that are fully paid, grouping the lines by invoice
+        '''
         pool = Pool()
-        Currency = pool.get('currency.currency')
         Invoice = pool.get('account.invoice')
         MoveLine = pool.get('account.move.line')
 
-        self.validate_line()
-
-        if self.invoice:
-            with Transaction().set_context(date=self.invoice.currency_date):
-                amount = Currency.compute(self.receipt.currency,
-                    self.amount, self.receipt.company.currency)
+        amounts = {}
+        invoice_lines = {}
+        for line in lines:
+            line.validate_line()
+            if not line.invoice:
+                continue
+            invoice = line.invoice
+            amount = compute_currency(line.receipt.currency,
+                line.amount, line.receipt.company.currency,
+                invoice.currency_date)
 
             amount_to_reconcile = abs(amount)
-            if ((self.invoice.type == 'in' and
-                    self.invoice.amount_to_pay > 0) or
-                    (self.invoice.type == 'out' and
-                        self.invoice.amount_to_pay < 0)):
+            if ((invoice.type == 'in' and
+                    invoice.amount_to_pay > 0) or
+                    (invoice.type == 'out' and
+                        invoice.amount_to_pay < 0)):
                 amount_to_reconcile *= -1
 
-            reconcile_lines, remainder = \
-                self.invoice.get_reconcile_lines_for_amount(
-                    amount_to_reconcile, self.currency)
+            assert line.line_move.account == invoice.account
 
-            assert self.line_move.account == self.invoice.account
+            amounts[invoice] = (
+                amounts.get(invoice, Decimal('0.0')) + amount_to_reconcile)
+            invoice_lines.setdefault(invoice, []).append(line)
 
-            Invoice.write([self.invoice], {
-                    'payment_lines': [('add', [self.line_move.id])],
-                    })
+        if not amounts:
+            return
 
+        to_write = []
+        to_reconcile = []
+        for invoice, amount in amounts.items():
+            reconcile_lines, remainder = \
+                invoice.get_reconcile_lines_for_amount(
+                    amount, invoice_lines[invoice][0].currency)
+            line_moves = [l.line_move for l in invoice_lines[invoice]]
+            to_write.extend(([invoice], {
+                        'payment_lines': [
+                            ('add', [ml.id for ml in line_moves])],
+                        }))
             if remainder == 0:
-                lines = reconcile_lines + [self.line_move]
-                MoveLine.reconcile(lines)
+                to_reconcile.append(list(reconcile_lines) + line_moves)
+
+        Invoice.write(*to_write)
+        if to_reconcile:
+            MoveLine.reconcile(*to_reconcile)
 
     def get_move_line(self, period):
         '''
@@ -1005,13 +1446,12 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
         '''
         pool = Pool()
         MoveLine = pool.get('account.move.line')
-        Currency = Pool().get('currency.currency')
+        ReceiptType = pool.get('cash_bank.receipt_type')
         zero = Decimal('0.0')
         debit = Decimal('0.0')
         credit = Decimal('0.0')
-        with Transaction().set_context(date=self.receipt.date):
-            amount = Currency.compute(self.receipt.currency,
-                self.amount, self.receipt.company.currency)
+        amount = compute_currency(self.receipt.currency,
+            self.amount, self.receipt.company.currency, self.receipt.date)
         if self.receipt.currency != self.receipt.company.currency:
             second_currency = self.receipt.currency
             amount_second_currency = self.amount
@@ -1019,7 +1459,7 @@ class Line(sequence_ordered(), ModelSQL, ModelView):
             amount_second_currency = None
             second_currency = None
 
-        if self.receipt.type.type == 'in':
+        if ReceiptType.get_metadata(self.receipt.type)['type'] == 'in':
             if amount > zero:
                 credit = amount
             else:
@@ -0,0 +1,301 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+'''
+Workflow throughput benchmark for Cash & Bank.
+
+The database is configured as for the tests, for example:
+
+    DB_NAME=:memory: python -m trytond.modules.cash_bank.tests.benchmark
+
+    TRYTOND_DATABASE_URI=postgresql:/// DB_NAME=benchmark \\
+        python -m trytond.modules.cash_bank.tests.benchmark \\
+        --receipts 5000 --output benchmark.json
+
+Everything is run in one transaction which is rolled back at the end.
+'''
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from decimal import Decimal
+
+from trytond.tests.test_tryton import activate_module, DB_NAME, USER, CONTEXT
+from trytond.modules.company.tests import create_company, set_company
+from trytond.modules.account.tests import create_chart
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+from trytond.modules.cash_bank.instrumentation import count_queries
+
+from .test_cash_bank import (
+    create_fiscalyear, create_journal, create_sequence,
+    create_cash_bank, create_receipt_types)
+
+
+class Benchmark(object):
+    'Collect wall time, SQL queries and peak memory per operation'
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.results = {}
+
+    @contextmanager
+    def measure(self, name, records):
+        if self.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with count_queries() as counter:
+            yield
+        elapsed = time.perf_counter() - start
+        peak = 0
+        if self.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        result = self.results.setdefault(name, {
+                'records': 0,
+                'time': 0.0,
+                'queries': 0,
+                'memory': 0,
+                })
+        result['records'] += len(records)
+        result['time'] += elapsed
+        result['queries'] += counter.count
+        result['memory'] = max(result['memory'], peak)
+
+
+def setup_company(name, args):
+    pool = Pool()
+    Account = pool.get('account.account')
+    Config = pool.get('cash_bank.configuration')
+    DocumentType = pool.get('cash_bank.document.type')
+    ReceiptType = pool.get('cash_bank.receipt_type')
+
+    company = create_company(name=name)
+    with set_company(company):
+        create_chart(company)
+        create_fiscalyear(company)
+
+        account_cash, = Account.search([
+                ('name', '=', 'Main Cash'),
+                ('company', '=', company.id),
+                ])
+        account_revenue, = Account.search([
+                ('name', '=', 'Main Revenue'),
+                ('company', '=', company.id),
+                ])
+        account_expense, = Account.search([
+                ('name', '=', 'Main Expense'),
+                ('company', '=', company.id),
+                ])
+        journal = create_journal(company, 'journal_cash')
+        sequence = create_sequence(
+            'Cash/Bank Receipt Sequence', 'Cash and Bank Receipt', company)
+        sequence_convertion = create_sequence(
+            'Cash/Bank Convertion', 'Cash and Bank Convertion', company)
+
+        config = Config(1)
+        config.account_transfer = account_expense
+        config.convertion_seq = sequence_convertion
+        config.save()
+
+        document_type = DocumentType(name='Cheque')
+        document_type.save()
+
+        boxes = []
+        for i in range(args.boxes):
+            account, = Account.copy([account_cash], {
+                    'name': 'Cash %s' % i,
+                    })
+            box = create_cash_bank(
+                company, 'Cashier %s' % i, 'cash',
+                journal, account, sequence)
+            extra_types = []
+            for j in range(1, args.types):
+                extra_types += create_receipt_types(
+                    'Cashier %s %s' % (i, j), sequence)
+            for receipt_type in extra_types:
+                receipt_type.cash_bank = box
+            ReceiptType.save(extra_types)
+            boxes.append(box)
+
+    return {
+        'company': company,
+        'boxes': boxes,
+        'account': account_revenue,
+        'document_type': document_type,
+        }
+
+
+def create_receipts(data, args, date):
+    pool = Pool()
+    Receipt = pool.get('cash_bank.receipt')
+    ReceiptType = pool.get('cash_bank.receipt_type')
+    Line = pool.get('cash_bank.receipt.line')
+    Document = pool.get('cash_bank.document')
+
+    company = data['company']
+    receipt_types = ReceiptType.search([
+            ('cash_bank', 'in', [b.id for b in data['boxes']]),
+            ('type', '=', 'in'),
+            ])
+    line_amount = Decimal(args.documents + 1)
+    receipts = []
+    for i in range(args.receipts):
+        receipt_type = receipt_types[i % len(receipt_types)]
+        receipt = Receipt(
+            company=company,
+            cash_bank=receipt_type.cash_bank,
+            type=receipt_type,
+            date=date,
+            cash=line_amount * args.lines - args.documents,
+            )
+        receipt.lines = [Line(
+                type='move_line',
+                amount=line_amount,
+                account=data['account'],
+                ) for _ in range(args.lines)]
+        receipt.documents = [Document(
+                type=data['document_type'],
+                amount=Decimal(1),
+                date=date,
+                reference='%s-%s' % (i, j),
+                ) for j in range(args.documents)]
+        receipts.append(receipt)
+    Receipt.save(receipts)
+    # The saved instances keep the values computed before the save
+    return Receipt.browse(receipts)
+
+
+def run(args):
+    pool = Pool()
+    Receipt = pool.get('cash_bank.receipt')
+    Transfer = pool.get('cash_bank.transfer')
+    Convertion = pool.get('cash_bank.convertion')
+
+    benchmark = Benchmark(memory=not args.no_memory)
+    date = datetime.date.today()
+    for i in range(args.companies):
+        data = setup_company('Company %s' % i, args)
+        company = data['company']
+        with set_company(company):
+            receipts = create_receipts(data, args, date)
+            with benchmark.measure('cash_bank.receipt.confirm', receipts):
+                Receipt.confirm(receipts)
+
+            half = len(receipts) // 2
+            to_post, to_cancel = receipts[:half], receipts[half:]
+            with benchmark.measure('cash_bank.receipt.post', to_post):
+                Receipt.post(to_post)
+            with benchmark.measure('cash_bank.receipt.cancel', to_cancel):
+                Receipt.cancel(to_cancel)
+
+            boxes = data['boxes']
+            transfers = []
+            if len(boxes) > 1:
+                box_from, box_to = boxes[:2]
+                for _ in range(args.transfers):
+                    transfers.append(Transfer(
+                            company=company,
+                            date=date,
+                            cash=Decimal(1),
+                            cash_bank_from=box_from,
+                            type_from=[t for t in box_from.receipt_types
+                                if t.type == 'out'][0],
+                            cash_bank_to=box_to,
+                            type_to=[t for t in box_to.receipt_types
+                                if t.type == 'in'][0],
+                            ))
+                Transfer.save(transfers)
+                transfers = Transfer.browse(transfers)
+            with benchmark.measure('cash_bank.transfer.confirm', transfers):
+                Transfer.confirm(transfers)
+            with benchmark.measure('cash_bank.transfer.post', transfers):
+                Transfer.post(transfers)
+
+            convertions = []
+            for receipt in to_post[:args.convertions]:
+                if receipt.documents:
+                    convertions.append(Convertion(
+                            company=company,
+                            cash_bank=receipt.cash_bank,
+                            date=date,
+                            documents=list(receipt.documents),
+                            ))
+            Convertion.save(convertions)
+            convertions = Convertion.browse(convertions)
+            with benchmark.measure(
+                    'cash_bank.convertion.confirm', convertions):
+                Convertion.confirm(convertions)
+    return benchmark.results
+
+
+def compare(results, previous):
+    for name, result in sorted(results.items()):
+        before = previous.get(name)
+        if not before:
+            continue
+        print('%-32s time x%.2f  queries x%.2f' % (
+                name,
+                result['time'] / before['time'] if before['time'] else 0,
+                (result['queries'] / before['queries']
+                    if before['queries'] else 0)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark Cash & Bank workflows')
+    parser.add_argument('--companies', type=int, default=1)
+    parser.add_argument('--boxes', type=int, default=2,
+        help='cash/bank per company')
+    parser.add_argument('--types', type=int, default=1,
+        help='pairs of in/out receipt types per cash/bank')
+    parser.add_argument('--receipts', type=int, default=1000,
+        help='receipts per company')
+    parser.add_argument('--lines', type=int, default=5,
+        help='lines per receipt')
+    parser.add_argument('--documents', type=int, default=2,
+        help='documents per receipt')
+    parser.add_argument('--transfers', type=int, default=100,
+        help='transfers per company')
+    parser.add_argument('--convertions', type=int, default=100,
+        help='convertions per company')
+    parser.add_argument('--no-memory', action='store_true',
+        help='do not trace memory allocations')
+    parser.add_argument('--output', help='JSON file to write results')
+    parser.add_argument('--compare', help='JSON file of previous results')
+    args = parser.parse_args(argv)
+
+    activate_module('cash_bank')
+    with Transaction().start(DB_NAME, USER, context=CONTEXT) as transaction:
+        backend = transaction.database.name
+        results = run(args)
+        transaction.rollback()
+
+    for name, result in sorted(results.items()):
+        print('%-32s %6d records %9.3fs %8d queries %10d bytes' % (
+                name, result['records'], result['time'],
+                result['queries'], result['memory']))
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp)['results'])
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                    'date': datetime.datetime.now().isoformat(),
+                    'database': backend,
+                    'python': platform.python_version(),
+                    'parameters': vars(args),
+                    'results': results,
+                    }, fp, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
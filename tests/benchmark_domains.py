@@ -0,0 +1,154 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+'''
+Timings and query plans of the domains of the document pickers and of the
+searches on rec_name.
+
+It needs a PostgreSQL database configured as for the tests, for example:
+
+    TRYTOND_DATABASE_URI=postgresql:/// DB_NAME=benchmark \\
+        python -m trytond.modules.cash_bank.tests.benchmark_domains \\
+        --receipts 200000 --output domains.json
+
+The data is generated with SQL inside one transaction which is rolled back
+at the end.
+'''
+import argparse
+import datetime
+import json
+import statistics
+import sys
+import time
+
+from trytond.tests.test_tryton import activate_module, DB_NAME, USER, CONTEXT
+from trytond.modules.company.tests import set_company
+from trytond.pool import Pool
+from trytond.pyson import PYSONEncoder, PYSONDecoder
+from trytond.transaction import Transaction
+
+from .benchmark_indexes import setup, generate, explain
+
+
+def field_domain(model, field, env):
+    'Return the domain of the field of model evaluated with env'
+    Model = Pool().get(model)
+    env = env.copy()
+    env.setdefault('context', Transaction().context)
+    return PYSONDecoder(env).decode(
+        PYSONEncoder().encode(Model._fields[field].domain))
+
+
+def searches(data):
+    '''
+    Return the name, model and domain of the searches to measure,
+    the domains of the pickers are evaluated for a draft record
+    '''
+    pool = Pool()
+    Receipt = pool.get('cash_bank.receipt')
+    box_from, box_to = data['boxes'][:2]
+
+    result = []
+    for type_ in ['in', 'out']:
+        receipt, = Receipt.search([
+                ('cash_bank', '=', box_from.id),
+                ('type.type', '=', type_),
+                ('state', '=', 'draft'),
+                ], limit=1)
+        result.append(('receipt %s documents' % type_, 'cash_bank.document',
+                field_domain('cash_bank.receipt', 'documents', {
+                        'id': receipt.id,
+                        'state': receipt.state,
+                        'type': receipt.type.id,
+                        'type_type': type_,
+                        })))
+    for state in ['draft', 'confirmed']:
+        result.append(('transfer %s documents' % state, 'cash_bank.document',
+                field_domain('cash_bank.transfer', 'documents', {
+                        'id': -1,
+                        'state': state,
+                        'type_from': box_from.receipt_types[0].id,
+                        'cash_bank_from': box_from.id,
+                        'cash_bank_to': box_to.id,
+                        })))
+    result.append(('convertion documents', 'cash_bank.document',
+            field_domain('cash_bank.convertion', 'documents', {
+                    'id': -1,
+                    'state': 'draft',
+                    'cash_bank': box_from.id,
+                    })))
+    result.append(('line rec_name', 'cash_bank.receipt.line', [
+                ('rec_name', 'ilike', '%R12345%'),
+                ]))
+    result.append(('document rec_name', 'cash_bank.document', [
+                ('rec_name', 'ilike', 'Cheq%'),
+                ]))
+    return result
+
+
+def measure(data, args):
+    pool = Pool()
+    result = {}
+    for name, model, domain in searches(data):
+        Model = pool.get(model)
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            records = Model.search(domain, limit=args.limit)
+            durations.append(time.perf_counter() - start)
+        plan, _ = explain(Model.search(domain, limit=args.limit, query=True))
+        result[name] = {
+            'domain': repr(domain),
+            'records': len(records),
+            'min': min(durations),
+            'median': statistics.median(durations),
+            'plan': plan,
+            }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the Cash & Bank document picker domains')
+    parser.add_argument('--boxes', type=int, default=10)
+    parser.add_argument('--types', type=int, default=1,
+        help='receipt types per cash/bank')
+    parser.add_argument('--receipts', type=int, default=200000)
+    parser.add_argument('--lines', type=int, default=2,
+        help='lines per receipt')
+    parser.add_argument('--documents', type=int, default=1,
+        help='documents per in receipt')
+    parser.add_argument('--limit', type=int, default=80,
+        help='records searched as by a picker')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='JSON file to write the results')
+    args = parser.parse_args(argv)
+    if args.boxes < 2:
+        parser.error('at least 2 boxes are required')
+
+    activate_module('cash_bank')
+    with Transaction().start(DB_NAME, USER, context=CONTEXT) as transaction:
+        if transaction.database.name != 'postgresql':
+            parser.error('a PostgreSQL database is required')
+        data = setup(args)
+        with set_company(data['company']):
+            generate(data, args)
+            results = measure(data, args)
+        transaction.rollback()
+
+    for name, result in results.items():
+        print('%-24s %6s records %9.3fms min %9.3fms median' % (
+                name, result['records'],
+                result['min'] * 1000, result['median'] * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                    'date': datetime.datetime.now().isoformat(),
+                    'parameters': vars(args),
+                    'results': results,
+                    }, fp, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+'''
+Query plans of the Cash & Bank search paths with and without the indexes
+of the module.
+
+It needs a PostgreSQL database configured as for the tests, for example:
+
+    TRYTOND_DATABASE_URI=postgresql:/// DB_NAME=benchmark \\
+        python -m trytond.modules.cash_bank.tests.benchmark_indexes \\
+        --receipts 1000000 --output plans.json
+
+The data is generated with SQL and the indexes are dropped inside one
+transaction which is rolled back at the end.
+'''
+import argparse
+import datetime
+import json
+import sys
+import time
+
+from trytond.tests.test_tryton import activate_module, DB_NAME, USER, CONTEXT
+from trytond.modules.company.tests import set_company
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+from .benchmark import setup_company
+
+
+def setup(args):
+    Party = Pool().get('party.party')
+    data = setup_company('Company', args)
+    with set_company(data['company']):
+        party = Party(name='Customer')
+        party.save()
+    data['party'] = party
+    return data
+
+
+def generate(data, args):
+    'Insert receipts with their lines and documents using SQL'
+    pool = Pool()
+    Receipt = pool.get('cash_bank.receipt')
+    Line = pool.get('cash_bank.receipt.line')
+    ReceiptType = pool.get('cash_bank.receipt_type')
+    Document = pool.get('cash_bank.document')
+    DocumentReceipt = pool.get('cash_bank.document-cash_bank.receipt')
+    cursor = Transaction().connection.cursor()
+
+    boxes = data['boxes']
+    types_in = [[t.id for t in b.receipt_types if t.type == 'in'][0]
+        for b in boxes]
+    types_out = [[t.id for t in b.receipt_types if t.type == 'out'][0]
+        for b in boxes]
+    company = data['company']
+
+    # The modulo is escaped for the table name and the parameters
+    cursor.execute(
+        'INSERT INTO "%s" (company, currency, cash_bank, type, date, '
+            'number, party, state, cash, total_lines, total_documents, '
+            'total, diff, create_uid, create_date) '
+        'SELECT %%s, %%s, '
+            '(%%s::integer[])[1 + i %%%% %%s], '
+            'CASE WHEN (i / %%s) %%%% 2 = 0 '
+                'THEN (%%s::integer[])[1 + i %%%% %%s] '
+                'ELSE (%%s::integer[])[1 + i %%%% %%s] END, '
+            'CURRENT_DATE - (i %%%% 730), '
+            "'R' || i, "
+            'CASE WHEN i %%%% 3 = 0 THEN %%s END, '
+            "(ARRAY['draft', 'confirmed', 'posted', 'cancel'])"
+                '[1 + i %%%% 4], '
+            '10, 10, 0, 10, 0, 0, NOW() '
+        'FROM generate_series(1, %%s) AS g(i)' % Receipt._table,
+        (company.id, company.currency.id,
+            [b.id for b in boxes], len(boxes),
+            len(boxes), types_in, len(boxes), types_out, len(boxes),
+            data['party'].id, args.receipts))
+
+    cursor.execute(
+        'INSERT INTO "%s" (receipt, type, amount, account, '
+            'create_uid, create_date) '
+        "SELECT r.id, 'move_line', 10, %%s, 0, NOW() "
+        'FROM "%s" AS r, generate_series(1, %%s) AS g(i)' % (
+            Line._table, Receipt._table),
+        (data['account'].id, args.lines))
+
+    cursor.execute(
+        'INSERT INTO "%s" (type, amount, date, reference, last_receipt, '
+            'current_cash_bank, status, create_uid, create_date) '
+        'SELECT %%s, 1, r.date, r.number, r.id, r.cash_bank, '
+            "CASE WHEN r.state IN ('confirmed', 'posted') "
+                "THEN 'in_hand' ELSE 'in_transit' END, 0, NOW() "
+        'FROM "%s" AS r JOIN "%s" AS t ON t.id = r.type, '
+            'generate_series(1, %%s) AS g(i) '
+        "WHERE t.type = 'in'" % (
+            Document._table, Receipt._table, ReceiptType._table),
+        (data['document_type'].id, args.documents))
+    cursor.execute(
+        'INSERT INTO "%s" (document, receipt, create_uid, create_date) '
+        'SELECT id, last_receipt, 0, NOW() FROM "%s"' % (
+            DocumentReceipt._table, Document._table))
+
+    for Model in [Receipt, Line, Document, DocumentReceipt]:
+        cursor.execute('ANALYZE "%s"' % Model._table)
+
+
+def searches(data):
+    'Return the name, model and domain of the searches to explain'
+    box = data['boxes'][0]
+    party = data['party']
+    return [
+        ('receipt by cash/bank and state', 'cash_bank.receipt', [
+                ('cash_bank', '=', box.id),
+                ('state', '=', 'confirmed'),
+                ]),
+        ('receipt by number', 'cash_bank.receipt', [
+                ('rec_name', 'ilike', '%R12345%'),
+                ]),
+        ('receipt by party', 'cash_bank.receipt', [
+                ('party', '=', party.id),
+                ('state', '=', 'draft'),
+                ]),
+        ('receipt by transfer', 'cash_bank.receipt', [
+                ('transfer', '!=', None),
+                ]),
+        ('line by receipt', 'cash_bank.receipt.line', [
+                ('receipt', '=', 1000),
+                ]),
+        ('line by invoice', 'cash_bank.receipt.line', [
+                ('invoice', '=', 1),
+                ]),
+        ('line by move line', 'cash_bank.receipt.line', [
+                ('line_move', '=', 1),
+                ]),
+        ('document by last receipt', 'cash_bank.document', [
+                ('last_receipt', '=', 1000),
+                ]),
+        ('document by convertion', 'cash_bank.document', [
+                ('convertion', '=', 1),
+                ]),
+        ('document in hand', 'cash_bank.document', [
+                ('current_cash_bank', '=', box.id),
+                ('status', '=', 'in_hand'),
+                ]),
+        ('receipt of document', 'cash_bank.document-cash_bank.receipt', [
+                ('document', '=', 1000),
+                ]),
+        ('documents of receipt', 'cash_bank.document-cash_bank.receipt', [
+                ('receipt', '=', 1000),
+                ]),
+        ]
+
+
+def explain(query, analyze=True):
+    'Return the plan and the execution time of the python-sql query'
+    cursor = Transaction().connection.cursor()
+    sql, params = tuple(query)
+    start = time.perf_counter()
+    cursor.execute('EXPLAIN %s%s' % (
+            '(ANALYZE, BUFFERS) ' if analyze else '', sql), params)
+    plan = '\n'.join(r[0] for r in cursor)
+    return plan, time.perf_counter() - start
+
+
+def explain_searches(data, analyze=True):
+    pool = Pool()
+    result = {}
+    for name, model, domain in searches(data):
+        Model = pool.get(model)
+        query = Model.search(domain, limit=80, query=True)
+        plan, duration = explain(query, analyze=analyze)
+        result[name] = {
+            'domain': repr(domain),
+            'time': duration,
+            'plan': plan,
+            }
+    return result
+
+
+def drop_indexes():
+    'Drop the indexes of the module which are not constraints'
+    pool = Pool()
+    cursor = Transaction().connection.cursor()
+    tables = [pool.get(m)._table for m in [
+            'cash_bank.receipt', 'cash_bank.receipt.line',
+            'cash_bank.document', 'cash_bank.document-cash_bank.receipt',
+            'cash_bank.document-cash_bank.transfer',
+            'cash_bank.document-cash_bank.convertion']]
+    cursor.execute('SELECT indexname FROM pg_indexes '
+        'WHERE tablename = ANY(%s) '
+        'AND indexname NOT IN (SELECT conname FROM pg_constraint)',
+        (tables,))
+    names = [r[0] for r in cursor]
+    for name in names:
+        cursor.execute('DROP INDEX "%s"' % name)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Explain the Cash & Bank searches')
+    parser.add_argument('--boxes', type=int, default=10)
+    parser.add_argument('--types', type=int, default=1,
+        help='receipt types per cash/bank')
+    parser.add_argument('--receipts', type=int, default=1000000)
+    parser.add_argument('--lines', type=int, default=2,
+        help='lines per receipt')
+    parser.add_argument('--documents', type=int, default=1,
+        help='documents per in receipt')
+    parser.add_argument('--output', help='JSON file to write the plans')
+    args = parser.parse_args(argv)
+
+    activate_module('cash_bank')
+    with Transaction().start(DB_NAME, USER, context=CONTEXT) as transaction:
+        if transaction.database.name != 'postgresql':
+            parser.error('a PostgreSQL database is required')
+        data = setup(args)
+        with set_company(data['company']):
+            start = time.perf_counter()
+            generate(data, args)
+            print('data generated in %.1fs' % (time.perf_counter() - start))
+
+            indexed = explain_searches(data)
+            dropped = drop_indexes()
+            not_indexed = explain_searches(data)
+        transaction.rollback()
+
+    for name in indexed:
+        print('%-32s %9.3fms with indexes %9.3fms without' % (
+                name, indexed[name]['time'] * 1000,
+                not_indexed[name]['time'] * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                    'date': datetime.datetime.now().isoformat(),
+                    'parameters': vars(args),
+                    'dropped': dropped,
+                    'with_indexes': indexed,
+                    'without_indexes': not_indexed,
+                    }, fp, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
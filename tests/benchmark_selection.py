@@ -0,0 +1,68 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+'''
+Microbenchmark of the selection getters and of the language lookup of the
+receipt lines compared to the uncached calls.
+
+It uses the database configured as for the tests, for example:
+
+    DB_NAME=:memory: \\
+        python -m trytond.modules.cash_bank.tests.benchmark_selection
+'''
+import argparse
+import sys
+import timeit
+
+from trytond.tests.test_tryton import activate_module, DB_NAME, USER, CONTEXT
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+
+def run(args):
+    pool = Pool()
+    Receipt = pool.get('cash_bank.receipt')
+    Line = pool.get('cash_bank.receipt.line')
+    ReceiptType = pool.get('cash_bank.receipt_type')
+    Lang = pool.get('ir.lang')
+
+    def search_lang():
+        lang, = Lang.search([
+                ('code', '=', Transaction().language),
+                ])
+        return lang
+
+    cases = [
+        ('receipt states',
+            lambda: Receipt.fields_get(['state'])['state']['selection'],
+            Line.get_receipt_states),
+        ('receipt line types',
+            lambda: Line.fields_get(['type'])['type']['selection'],
+            ReceiptType.get_receipt_line_type),
+        ('language', search_lang, Lang.get),
+        ]
+    for name, uncached, cached in cases:
+        assert uncached() == cached()
+        before = min(timeit.repeat(uncached, number=args.number, repeat=3))
+        after = min(timeit.repeat(cached, number=args.number, repeat=3))
+        print('%-20s %9.2fus uncached %9.2fus cached %7.1fx' % (
+                name,
+                before / args.number * 1e6, after / args.number * 1e6,
+                before / after if after else float('inf')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the selection getters of Cash & Bank')
+    parser.add_argument('--number', type=int, default=1000,
+        help='calls per measure')
+    args = parser.parse_args(argv)
+
+    activate_module('cash_bank')
+    with Transaction().start(DB_NAME, USER, context=CONTEXT) as transaction:
+        run(args)
+        transaction.rollback()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
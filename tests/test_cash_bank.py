@@ -6,12 +6,16 @@ import trytond.tests.test_tryton
 import datetime
 from decimal import Decimal
 from trytond.tests.test_tryton import ModuleTestCase, with_transaction
+from trytond.tests.test_tryton import DB_NAME, USER, CONTEXT
 from trytond.modules.company.tests import create_company, set_company
 from trytond.modules.account.tests import create_chart, get_fiscalyear
 from trytond.pool import Pool
 from trytond.transaction import Transaction
 from trytond.exceptions import UserError
+from trytond.model.modelview import AccessButtonError
 from trytond.model.modelsql import SQLConstraintError, RequiredValidationError
+from trytond.modules.cash_bank.instrumentation import get_query_count
+from trytond.modules.cash_bank.log_archive import LOGS
 
 
 class CashBankTestCase(ModuleTestCase):
@@ -28,6 +32,7 @@ class CashBankTestCase(ModuleTestCase):
         DocumentType = pool.get('cash_bank.document.type')
         Document = pool.get('cash_bank.document')
         Docs = pool.get('cash_bank.document-cash_bank.receipt')
+        Movement = pool.get('cash_bank.document.movement')
         Transfer = pool.get('cash_bank.transfer')
         Convertion = pool.get('cash_bank.convertion')
         CashBank = pool.get('cash_bank.cash_bank')
@@ -224,6 +229,9 @@ class CashBankTestCase(ModuleTestCase):
             self.assertEqual(receipt.total_documents, Decimal('90.0'))
             self.assertEqual(receipt.total, Decimal('100.0'))
             self.assertEqual(receipt.diff, Decimal('-100.0'))
+            for doc in receipt.documents:
+                self.assertEqual(doc.status, 'in_transit')
+                self.assertEqual(doc.current_cash_bank, cash)
 
             self._verify_document('abc', receipt.id)
             self._verify_document('def', receipt.id)
@@ -438,6 +446,20 @@ class CashBankTestCase(ModuleTestCase):
             self._verify_document('def', transfer.receipt_to.id)
             self._verify_document('ghi', transfer.receipt_to.id)
 
+            for doc in Document.search([]):
+                self.assertEqual(doc.status, 'in_hand')
+                self.assertEqual(doc.current_cash_bank, cash_2)
+            movements = Movement.get_last_movements(Document.search([]))
+            for movement in movements.values():
+                self.assertEqual(movement.type, 'transfer')
+                self.assertEqual(movement.direction, 'in')
+                self.assertEqual(movement.receipt, transfer.receipt_to)
+            locations = Movement.get_locations(Document.search([]), date)
+            self.assertEqual(set(locations.values()), {cash_2})
+            cash, cash_2 = CashBank.browse([cash.id, cash_2.id])
+            self.assertEqual(cash.documents_in_hand_total, Decimal('0.0'))
+            self.assertEqual(cash_2.documents_in_hand_total, Decimal('90.0'))
+
             # Convertions
 
             with self.assertRaises(UserError):
@@ -461,6 +483,12 @@ class CashBankTestCase(ModuleTestCase):
             docs = Document.search([])
             for doc in docs:
                 self.assertEqual(doc.convertion.id, convertion.id)
+            for doc in docs:
+                self.assertEqual(doc.status, 'converted')
+            locations = Movement.get_locations(docs, date)
+            self.assertEqual(set(locations.values()), {None})
+            self.assertEqual(
+                CashBank(cash_2.id).documents_in_hand_total, Decimal('0.0'))
 
             Convertion.cancel([convertion])
             self.assertEqual(convertion.state, 'cancel')
@@ -474,6 +502,587 @@ class CashBankTestCase(ModuleTestCase):
             for doc in docs:
                 self.assertEqual(doc.convertion, None)
 
+    @with_transaction()
+    def test_receipt_confirm_query_count(self):
+        pool = Pool()
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptLine = pool.get('cash_bank.receipt.line')
+
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+
+            def confirm_count(receipts, lines):
+                for receipt in receipts:
+                    receipt.cash = Decimal(lines)
+                    receipt.lines = [
+                        ReceiptLine(
+                            amount=Decimal('1.0'),
+                            account=account_revenue,
+                            type='move_line',
+                            ) for _ in range(lines)]
+                Receipt.save(receipts)
+                Receipt.confirm(receipts)
+                return get_query_count(Receipt, 'confirm')
+
+            def receipts(count):
+                return [create_receipt(company, cash, 'in', date)
+                    for _ in range(count)]
+
+            few_lines = confirm_count(receipts(2), 5)
+            many_lines = confirm_count(receipts(2), 25)
+
+            # A line only costs the insertion of its move line as
+            # ModelSQL.create inserts the records one by one, everything
+            # else is done per batch
+            self.assertLessEqual(many_lines - 2 * 25, few_lines - 2 * 5 + 2)
+
+            # Each line is linked to its own move line
+            batch = receipts(2)
+            for receipt in batch:
+                receipt.cash = Decimal('6.0')
+                receipt.lines = [
+                    ReceiptLine(
+                        amount=Decimal(amount),
+                        account=account_revenue,
+                        type='move_line',
+                        ) for amount in [1, 2, 3]]
+            Receipt.save(batch)
+            Receipt.confirm(batch)
+            for receipt in Receipt.browse(batch):
+                self.assertEqual(receipt.line_move.move, receipt.move)
+                self.assertEqual(receipt.line_move.debit, Decimal('6.0'))
+                for line in receipt.lines:
+                    self.assertEqual(line.line_move.move, receipt.move)
+                    self.assertEqual(line.line_move.credit, line.amount)
+
+            def cancel_count(count):
+                to_cancel = receipts(count)
+                confirm_count(to_cancel, 1)
+                logs = count_logs()
+                Receipt.cancel(to_cancel)
+                # The log model creates its records one by one
+                return (get_query_count(Receipt, 'cancel')
+                    - (count_logs() - logs))
+
+            few_receipts = cancel_count(2)
+            many_receipts = cancel_count(20)
+
+            # Lines and moves are deleted and written per batch
+            self.assertLessEqual(many_receipts, few_receipts + 2)
+
+    @with_transaction()
+    def test_balance(self):
+        pool = Pool()
+        Account = pool.get('account.account')
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptLine = pool.get('cash_bank.receipt.line')
+        Balance = pool.get('cash_bank.balance')
+        CashBank = pool.get('cash_bank.cash_bank')
+
+        party = self._create_party('Party test', None)
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+            account_expense, = Account.search([
+                    ('name', '=', 'Main Expense'),
+                    ])
+
+            def receipt(type_, amount, account):
+                receipt = create_receipt(company, cash, type_, date, party)
+                receipt.cash = amount
+                receipt.lines = [ReceiptLine(
+                        amount=amount,
+                        account=account,
+                        type='move_line',
+                        )]
+                receipt.save()
+                return receipt
+
+            def balances():
+                return Balance.get_balances([cash], date)[cash.id]
+
+            receipt_in = receipt('in', Decimal('100.0'), account_revenue)
+            Receipt.confirm([receipt_in])
+            self.assertEqual(balances(), (Decimal('100.0'), Decimal('0.0')))
+            Receipt.post([receipt_in])
+            self.assertEqual(
+                balances(), (Decimal('100.0'), Decimal('100.0')))
+
+            receipt_out = receipt('out', Decimal('30.0'), account_expense)
+            Receipt.confirm([receipt_out])
+            self.assertEqual(balances(), (Decimal('70.0'), Decimal('100.0')))
+
+            receipt_cancel = receipt('in', Decimal('50.0'), account_revenue)
+            Receipt.confirm([receipt_cancel])
+            Receipt.cancel([receipt_cancel])
+            self.assertEqual(balances(), (Decimal('70.0'), Decimal('100.0')))
+
+            balance, = Balance.search([('cash_bank', '=', cash.id)])
+            self.assertEqual(balance.amount, Decimal('70.0'))
+            self.assertEqual(balance.posted_amount, Decimal('100.0'))
+
+            CashBank.rebuild_balance([cash])
+            self.assertEqual(balances(), (Decimal('70.0'), Decimal('100.0')))
+            self.assertEqual(Balance.get_balances(
+                    [cash], date - datetime.timedelta(days=1))[cash.id],
+                (Decimal('0.0'), Decimal('0.0')))
+
+            cash = CashBank(cash.id)
+            self.assertEqual(cash.balance, Decimal('100.0'))
+            self.assertEqual(cash.balance_confirmed, Decimal('70.0'))
+            self.assertEqual(cash.documents_in_hand_total, Decimal('0.0'))
+
+    @with_transaction()
+    def test_timing_statistics(self):
+        pool = Pool()
+        Config = pool.get('cash_bank.configuration')
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptLine = pool.get('cash_bank.receipt.line')
+        Timing = pool.get('cash_bank.timing')
+        Statistic = pool.get('cash_bank.timing.statistic')
+        SlowOperation = pool.get('cash_bank.slow_operation')
+
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+            config = Config(timing_statistics=True, slow_threshold=1e-9)
+            config.save()
+
+            for _ in range(3):
+                receipt = create_receipt(company, cash, 'in', date)
+                receipt.cash = Decimal('10.0')
+                receipt.lines = [ReceiptLine(
+                        amount=Decimal('10.0'),
+                        account=account_revenue,
+                        type='move_line',
+                        )]
+                receipt.save()
+                Receipt.confirm([receipt])
+
+            statistic, = Statistic.search([
+                    ('name', '=', 'cash_bank.receipt.confirm'),
+                    ])
+            self.assertEqual(statistic.count, 3)
+            self.assertGreater(statistic.total_time, 0)
+            self.assertLessEqual(statistic.p95, statistic.total_time)
+            phases = Statistic.search([
+                    ('name', 'like', 'cash_bank.receipt.confirm:%'),
+                    ])
+            self.assertEqual(
+                {p.name.split(':')[1] for p in phases},
+                {'validate', 'moves', 'validate_line', 'save',
+                    'set_number', 'balance', 'document_movements', 'log'})
+
+            slow_operations = SlowOperation.search([
+                    ('name', '=', 'cash_bank.receipt.confirm'),
+                    ])
+            self.assertEqual(len(slow_operations), 3)
+            slow = slow_operations[0]
+            self.assertEqual(slow.company, company)
+            self.assertEqual(slow.records, 1)
+            self.assertEqual(slow.lines, 1)
+            self.assertEqual(slow.documents, 0)
+            self.assertGreater(slow.queries, 0)
+            self.assertIn('"id": %s' % receipt.id,
+                ''.join(s.breakdown for s in slow_operations))
+
+            # Old timings are pruned
+            timing = Timing.__table__()
+            cursor = Transaction().connection.cursor()
+            cursor.execute(*timing.update(
+                    columns=[timing.create_date],
+                    values=[datetime.datetime.now()
+                        - datetime.timedelta(days=60)],
+                    where=timing.name == 'cash_bank.receipt.confirm'))
+            Timing.prune()
+            self.assertEqual(Statistic.search([
+                        ('name', '=', 'cash_bank.receipt.confirm'),
+                        ], count=True), 0)
+            self.assertNotEqual(Statistic.search([], count=True), 0)
+
+    def test_slow_operation_failure(self):
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) as transaction:
+            pool = Pool()
+            Config = pool.get('cash_bank.configuration')
+            Receipt = pool.get('cash_bank.receipt')
+
+            config = Config(slow_threshold=1e-9)
+            config.save()
+            # The unsaved receipt makes the call fail
+            with self.assertRaises(AttributeError):
+                Receipt.confirm([Receipt()])
+            transaction.rollback()
+
+        # The failing call is kept once its transaction is rolled back
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) as transaction:
+            pool = Pool()
+            Config = pool.get('cash_bank.configuration')
+            SlowOperation = pool.get('cash_bank.slow_operation')
+
+            slow, = SlowOperation.search([
+                    ('name', '=', 'cash_bank.receipt.confirm'),
+                    ])
+            self.assertEqual(slow.records, 1)
+            self.assertEqual(slow.lines, 0)
+
+            # SQLite in memory shares the connection with the new transaction
+            SlowOperation.delete([slow])
+            Value = Config.multivalue_model('slow_threshold')
+            Value.delete(Value.search([]))
+            transaction.commit()
+
+    @with_transaction()
+    def test_document_workflow_query_count(self):
+        pool = Pool()
+        Config = pool.get('cash_bank.configuration')
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptLine = pool.get('cash_bank.receipt.line')
+        DocumentType = pool.get('cash_bank.document.type')
+        Convertion = pool.get('cash_bank.convertion')
+
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+            sequence_convertion = create_sequence(
+                'Cash/Bank Convertion',
+                'Cash and Bank Convertion',
+                company)
+            config = Config(convertion_seq=sequence_convertion)
+            config.save()
+            cheque_type = DocumentType(name='Cheque')
+            cheque_type.save()
+
+            def workflow_counts(documents):
+                receipts = [create_receipt(company, cash, 'in', date)
+                    for _ in range(2)]
+                for receipt in receipts:
+                    receipt.cash = Decimal('1.0')
+                    receipt.lines = [ReceiptLine(
+                            amount=Decimal(documents + 1),
+                            account=account_revenue,
+                            type='move_line',
+                            )]
+                    receipt.documents = [
+                        self._get_document(
+                            cheque_type, Decimal('1.0'), date, str(i))
+                        for i in range(documents)]
+                Receipt.save(receipts)
+                receipt, other = receipts
+
+                counts = []
+
+                def count(Model, name, records):
+                    logs = count_logs()
+                    getattr(Model, name)(records)
+                    # The log model creates its records one by one
+                    counts.append(get_query_count(Model, name)
+                        - (count_logs() - logs))
+
+                count(Receipt, 'confirm', receipts)
+                count(Receipt, 'post', [receipt])
+                count(Receipt, 'cancel', [other])
+
+                convertion = Convertion(
+                    company=company,
+                    cash_bank=cash,
+                    date=date,
+                    documents=list(receipt.documents),
+                    )
+                convertion.save()
+                count(Convertion, 'confirm', [convertion])
+                return counts
+
+            few_documents = workflow_counts(2)
+            many_documents = workflow_counts(20)
+
+            # Documents are linked and converted per batch
+            for few, many in zip(few_documents, many_documents):
+                self.assertLessEqual(many, few + 2)
+
+    @with_transaction()
+    def test_function_fields(self):
+        pool = Pool()
+        Config = pool.get('cash_bank.configuration')
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptLine = pool.get('cash_bank.receipt.line')
+        DocumentType = pool.get('cash_bank.document.type')
+        Document = pool.get('cash_bank.document')
+        Convertion = pool.get('cash_bank.convertion')
+
+        party = self._create_party('Party test', None)
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+            sequence_convertion = create_sequence(
+                'Cash/Bank Convertion',
+                'Cash and Bank Convertion',
+                company)
+            config = Config(convertion_seq=sequence_convertion)
+            config.save()
+            cheque_type = DocumentType(name='Cheque')
+            cheque_type.save()
+
+            receipts = [
+                create_receipt(company, cash, 'in', date, party),
+                create_receipt(company, cash, 'out', date),
+                ]
+            for receipt in receipts:
+                receipt.cash = Decimal('1.0')
+                receipt.lines = [ReceiptLine(
+                        amount=Decimal('1.0'),
+                        account=account_revenue,
+                        type='move_line',
+                        )]
+            receipts[0].cash = Decimal('3.0')
+            receipts[0].lines[0].amount = Decimal('6.0')
+            receipts[0].documents = [
+                self._get_document(cheque_type, Decimal('1.0'), date, '1'),
+                self._get_document(cheque_type, Decimal('2.0'), date, '2'),
+                ]
+            Receipt.save(receipts)
+            Receipt.confirm(receipts[:1])
+
+            # The logs buffered by confirm are written at its end
+            self.assertEqual(len(Receipt(receipts[0].id).logs), 2)
+            for document in receipts[0].documents:
+                self.assertEqual(len(document.logs), 2)
+
+            # The classmethod getters give the values of the on_change
+            for receipt in Receipt.browse(receipts):
+                for name in ['type_type', 'party_required',
+                        'bank_account_show', 'bank_account_required',
+                        'currency_digits']:
+                    self.assertEqual(getattr(receipt, name),
+                        getattr(receipt, 'on_change_with_' + name)())
+                self.assertEqual(
+                    [a.id for a in receipt.bank_account_owners],
+                    receipt.on_change_with_bank_account_owners())
+                for line in receipt.lines:
+                    self.assertEqual(line.currency.id,
+                        line.on_change_with_currency())
+                    self.assertEqual(line.currency_digits,
+                        line.on_change_with_currency_digits())
+                    self.assertEqual(bool(line.party_required),
+                        bool(line.on_change_with_party_required()))
+                    self.assertEqual(line.receipt_state, receipt.state)
+            for document in Document.search([]):
+                self.assertEqual(document.currency_digits,
+                    company.currency.digits)
+
+            convertion = Convertion(
+                company=company,
+                cash_bank=cash,
+                date=date,
+                documents=list(receipts[0].documents),
+                )
+            convertion.save()
+            convertion = Convertion(convertion.id)
+            self.assertEqual(convertion.total_documents, Decimal('3.0'))
+
+    @with_transaction()
+    def test_document_in_receipts_of_batch(self):
+        pool = Pool()
+        Receipt = pool.get('cash_bank.receipt')
+        DocumentType = pool.get('cash_bank.document.type')
+        Document = pool.get('cash_bank.document')
+
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+            cheque_type = DocumentType(name='Cheque')
+            cheque_type.save()
+            document = self._get_document(
+                cheque_type, Decimal('1.0'), date, 'x')
+            document.save()
+
+            receipts = [create_receipt(company, cash, 'in', date)
+                for _ in range(2)]
+            for receipt in receipts:
+                receipt.documents = [document]
+            Receipt.save(receipts)
+
+            # The document is assigned to the last receipt
+            document = Document(document.id)
+            self.assertEqual(
+                document.last_receipt, max(receipts, key=lambda r: r.id))
+
+    @with_transaction()
+    def test_company_currency_cache(self):
+        pool = Pool()
+        Currency = pool.get('currency.currency')
+        Receipt = pool.get('cash_bank.receipt')
+        Document = pool.get('cash_bank.document')
+
+        company = create_company()
+        with set_company(company):
+            currency = company.currency
+            self.assertEqual(Receipt.default_currency(), currency.id)
+            self.assertEqual(
+                Receipt.default_currency_digits(), currency.digits)
+
+            Currency.write([currency], {'digits': 3})
+            self.assertEqual(Receipt.default_currency_digits(), 3)
+            self.assertEqual(Document.default_currency_digits(), 3)
+
+            other, = Currency.copy([currency], {'code': 'XXX'})
+            company.currency = other
+            company.save()
+            self.assertEqual(Receipt.default_currency(), other.id)
+
+    @with_transaction()
+    def test_configuration_cache(self):
+        pool = Pool()
+        Config = pool.get('cash_bank.configuration')
+        CashBank = pool.get('cash_bank.cash_bank')
+        ReceiptType = pool.get('cash_bank.receipt_type')
+
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+
+            self.assertEqual(Config.get_cached_multivalue('month_allow'), None)
+            config = Config(month_allow='3', account_transfer=account_cash)
+            config.save()
+            self.assertEqual(Config.get_cached_multivalue('month_allow'), '3')
+            self.assertEqual(
+                Config.get_cached_multivalue('account_transfer'), account_cash)
+            config.month_allow = None
+            config.save()
+            self.assertEqual(Config.get_cached_multivalue('month_allow'), None)
+
+            self.assertEqual(
+                CashBank.get_metadata(cash)['account'], account_cash.id)
+            cash.account = account_revenue
+            cash.save()
+            self.assertEqual(
+                CashBank.get_metadata(cash)['account'], account_revenue.id)
+
+            receipt_type = cash.receipt_types[0]
+            self.assertFalse(
+                ReceiptType.get_metadata(receipt_type)['party_required'])
+            receipt_type.party_required = True
+            receipt_type.save()
+            self.assertTrue(
+                ReceiptType.get_metadata(receipt_type)['party_required'])
+
+    @with_transaction()
+    def test_workflow_queue_access(self):
+        pool = Pool()
+        Config = pool.get('cash_bank.configuration')
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptLine = pool.get('cash_bank.receipt.line')
+        User = pool.get('res.user')
+        ModelData = pool.get('ir.model.data')
+        Queue = pool.get('ir.queue')
+
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+            config = Config(workflow_queue=True)
+            config.save()
+
+            receipt = create_receipt(company, cash, 'in', date)
+            receipt.cash = Decimal('10.0')
+            receipt.lines = [ReceiptLine(
+                    amount=Decimal('10.0'),
+                    account=account_revenue,
+                    type='move_line',
+                    )]
+            receipt.save()
+
+            user = User(login='clerk', name='Clerk',
+                companies=[company], company=company,
+                groups=[ModelData.get_id('cash_bank', 'group_cash_bank')])
+            user.save()
+            queued = Queue.search([], count=True)
+
+            # The access to the button is checked before the queueing
+            with Transaction().set_user(user.id), \
+                    Transaction().set_context(_check_access=True):
+                with self.assertRaises(AccessButtonError):
+                    Receipt.confirm([receipt])
+            self.assertEqual(Queue.search([], count=True), queued)
+
+    @with_transaction()
+    def test_log_archive(self):
+        pool = Pool()
+        Config = pool.get('cash_bank.configuration')
+        Receipt = pool.get('cash_bank.receipt')
+        ReceiptLog = pool.get('cash_bank.receipt.log_action')
+        DocumentType = pool.get('cash_bank.document.type')
+        Document = pool.get('cash_bank.document')
+        DocumentLog = pool.get('cash_bank.document.log_action')
+        LogArchive = pool.get('cash_bank.log_action.archive')
+
+        company = create_company()
+        with set_company(company):
+            cash, account_cash, account_revenue, date = create_cash_setup(
+                company)
+            old, new = [create_receipt(company, cash, 'in', date)
+                for _ in range(2)]
+            Receipt.save([old, new])
+
+            cheque_type = DocumentType(name='Cheque')
+            cheque_type.save()
+            document = self._get_document(
+                cheque_type, Decimal('1.0'), date, 'x')
+            document.save()
+
+            cursor = Transaction().connection.cursor()
+            for Log, resource in [(ReceiptLog, old), (DocumentLog, document)]:
+                log = Log.__table__()
+                cursor.execute(*log.update(
+                        columns=[log.date],
+                        values=[datetime.datetime.now()
+                            - datetime.timedelta(days=10)],
+                        where=log.resource == resource.id))
+
+            # Nothing is archived without retention
+            LogArchive.archive(commit=False)
+            self.assertEqual(LogArchive.search([], count=True), 0)
+
+            config = Config(log_retention=5)
+            config.save()
+            LogArchive.archive(commit=False)
+
+            old = Receipt(old.id)
+            new = Receipt(new.id)
+            self.assertEqual(len(old.logs), 0)
+            self.assertEqual(len(new.logs), 1)
+            archived, = LogArchive.search([
+                    ('resource_model', '=', 'cash_bank.receipt'),
+                    ('resource_id', '=', old.id),
+                    ])
+            self.assertEqual(archived.resource, old)
+            self.assertEqual(archived.company, company)
+
+            # Documents without company keep their logs
+            self.assertEqual(len(Document(document.id).logs), 1)
+
+        with Transaction().set_context(company=None):
+            config = Config(1)
+            config.log_retention = 5
+            config.save()
+        LogArchive.archive(commit=False)
+
+        # They are archived with the retention set without company
+        self.assertEqual(len(Document(document.id).logs), 0)
+        archived, = LogArchive.search([
+                ('resource_model', '=', 'cash_bank.document'),
+                ])
+        self.assertEqual(archived.resource, document)
+        self.assertEqual(archived.company, None)
+
     def _validate_domain_in(self, Receipt, Document, receipt_1):
         self._verify_document('abc', receipt_1.id)
         self._verify_document('def', receipt_1.id)
@@ -541,6 +1150,12 @@ class CashBankTestCase(ModuleTestCase):
         return party
 
 
+def count_logs():
+    'Return the number of logs of the module'
+    pool = Pool()
+    return sum(pool.get(log).search([], count=True) for log, _ in LOGS)
+
+
 def create_bank_account(party_bank, party_owner):
     pool = Pool()
     Bank = pool.get('bank')
@@ -653,6 +1268,32 @@ def create_cash_bank(
     return cash
 
 
+def create_cash_setup(company):
+    '''
+    Create the chart, the fiscal year and a cash of company,
+    return the cash, its account, a revenue account and the date
+    '''
+    Account = Pool().get('account.account')
+    create_chart(company)
+    create_fiscalyear(company)
+    account_cash, = Account.search([
+            ('name', '=', 'Main Cash'),
+            ])
+    account_revenue, = Account.search([
+            ('name', '=', 'Main Revenue'),
+            ])
+    journal = create_journal(company, 'journal_cash')
+    sequence = create_sequence(
+        'Cash/Bank Receipt Sequence',
+        'Cash and Bank Receipt',
+        company)
+    cash = create_cash_bank(
+        company, 'Main Cashier', 'cash',
+        journal, account_cash, sequence
+        )
+    return cash, account_cash, account_revenue, datetime.date.today()
+
+
 def create_receipt(
         company, cash_bank, receipt_type, date, party=None):
     pool = Pool()
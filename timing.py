@@ -0,0 +1,172 @@
+# This file is part of Cash & Bank module.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import datetime
+import json
+import math
+from trytond.config import config
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.model import ModelView, ModelSQL, fields
+from trytond.tools import grouped_slice
+from sql import Literal, Null
+from sql.aggregate import Count, Min, Sum
+from sql.functions import CurrentTimestamp
+from collections import defaultdict
+
+
+class Timing(ModelSQL):
+    "Cash/Bank Timing"
+    __name__ = 'cash_bank.timing'
+    name = fields.Char('Name', required=True, readonly=True)
+    records = fields.Integer('Records', readonly=True)
+    duration = fields.Float('Duration', readonly=True,
+        help='In seconds.')
+
+    @classmethod
+    def record(cls, name, duration, records, phases):
+        '''
+        Store the duration of the call name and of each of its phases,
+        phases are stored as name:phase
+        '''
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        values = [[name, records, duration]]
+        for phase, phase_duration in phases.items():
+            values.append(['%s:%s' % (name, phase), records, phase_duration])
+        cursor.execute(*table.insert(
+                columns=[
+                    table.name, table.records, table.duration,
+                    table.create_uid, table.create_date],
+                values=[v + [transaction.user, CurrentTimestamp()]
+                    for v in values]))
+
+    @classmethod
+    def prune(cls):
+        'Delete the timings older than the timing_retention option'
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        days = config.getint('cash_bank', 'timing_retention', default=30)
+        if not days:
+            return
+        limit = datetime.datetime.now() - datetime.timedelta(days=days)
+        cursor.execute(*table.delete(where=table.create_date < limit))
+
+
+class TimingStatistic(ModelSQL, ModelView):
+    "Cash/Bank Timing Statistic"
+    __name__ = 'cash_bank.timing.statistic'
+    name = fields.Char('Name', readonly=True)
+    count = fields.Integer('Count', readonly=True)
+    total_time = fields.Float('Total Time', readonly=True,
+        help='In seconds.')
+    p95 = fields.Function(fields.Float('95th Percentile',
+        help='In seconds.'), 'get_p95')
+
+    @classmethod
+    def __setup__(cls):
+        super(TimingStatistic, cls).__setup__()
+        cls._order.insert(0, ('total_time', 'DESC'))
+
+    @classmethod
+    def table_query(cls):
+        Timing = Pool().get('cash_bank.timing')
+        timing = Timing.__table__()
+        return timing.select(
+            Min(timing.id).as_('id'),
+            Literal(0).as_('create_uid'),
+            CurrentTimestamp().as_('create_date'),
+            Literal(Null).as_('write_uid'),
+            Literal(Null).as_('write_date'),
+            timing.name,
+            Count(Literal('*')).as_('count'),
+            Sum(timing.duration).as_('total_time'),
+            group_by=[timing.name])
+
+    @classmethod
+    def get_p95(cls, statistics, name):
+        Timing = Pool().get('cash_bank.timing')
+        timing = Timing.__table__()
+        cursor = Transaction().connection.cursor()
+
+        ids = {s.name: s.id for s in statistics}
+        durations = defaultdict(list)
+        for sub_names in grouped_slice(list(ids)):
+            cursor.execute(*timing.select(timing.name, timing.duration,
+                    where=timing.name.in_(list(sub_names)),
+                    order_by=[timing.name, timing.duration]))
+            for name_, duration in cursor:
+                durations[name_].append(duration)
+
+        result = {}
+        for name_, id_ in ids.items():
+            values = durations[name_]
+            if values:
+                index = max(int(math.ceil(len(values) * 0.95)) - 1, 0)
+                result[id_] = values[index]
+            else:
+                result[id_] = None
+        return result
+
+
+class SlowOperation(ModelSQL, ModelView):
+    "Cash/Bank Slow Operation"
+    __name__ = 'cash_bank.slow_operation'
+    company = fields.Many2One('company.company', 'Company', readonly=True)
+    name = fields.Char('Name', readonly=True)
+    duration = fields.Float('Duration', readonly=True,
+        help='In seconds.')
+    queries = fields.Integer('Queries', readonly=True)
+    records = fields.Integer('Records', readonly=True)
+    lines = fields.Integer('Lines', readonly=True)
+    documents = fields.Integer('Documents', readonly=True)
+    phases = fields.Text('Phases', readonly=True)
+    breakdown = fields.Text('Breakdown', readonly=True,
+        help='The lines and documents of each record.')
+
+    @classmethod
+    def __setup__(cls):
+        super(SlowOperation, cls).__setup__()
+        cls._order.insert(0, ('create_date', 'DESC'))
+
+    @classmethod
+    def record(cls, name, records, duration, queries, phases, commit=False):
+        '''
+        Store the call name with the number of lines and documents
+        of each of its records.
+        When commit is set, the operation is stored in a new transaction
+        to be kept when the transaction of the call is rolled back.
+        '''
+        table = cls.__table__()
+        transaction = Transaction()
+        breakdown = []
+        for record in records:
+            breakdown.append({
+                    'id': record.id,
+                    'lines': len(getattr(record, 'lines', None) or []),
+                    'documents': len(
+                        getattr(record, 'documents', None) or []),
+                    })
+        insert = table.insert(
+            columns=[
+                table.company, table.name, table.duration,
+                table.queries, table.records, table.lines,
+                table.documents, table.phases, table.breakdown,
+                table.create_uid, table.create_date],
+            values=[[
+                    transaction.context.get('company'), name, duration,
+                    queries, len(records),
+                    sum(r['lines'] for r in breakdown),
+                    sum(r['documents'] for r in breakdown),
+                    json.dumps(phases, indent=1, sort_keys=True),
+                    json.dumps(breakdown),
+                    transaction.user, CurrentTimestamp()]])
+        if commit:
+            with transaction.new_transaction() as new_transaction:
+                cursor = new_transaction.connection.cursor()
+                cursor.execute(*insert)
+                new_transaction.commit()
+        else:
+            cursor = transaction.connection.cursor()
+            cursor.execute(*insert)
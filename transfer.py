@@ -3,11 +3,15 @@
 # the full copyright notices and license terms.
 from trytond.transaction import Transaction
 from trytond.pool import Pool
-from trytond.model import Workflow, ModelView, ModelSQL, fields
+from trytond.model import Workflow, ModelView, ModelSQL, fields, Index
 from trytond.pyson import Eval, If, Bool, Or
-from trytond.modules.log_action import LogActionMixin, write_log
+from trytond.modules.log_action import LogActionMixin
 from trytond.i18n import gettext
 from trytond.exceptions import UserError
+from trytond.tools import reduce_ids, grouped_slice
+from .common import queue_workflow, get_company_currency, add_log
+from .instrumentation import instrumented, span
+from sql.aggregate import Sum
 from decimal import Decimal
 
 _STATES = {
@@ -102,12 +106,12 @@ class Transfer(Workflow, ModelSQL, ModelView):
                             ('convertion', '=', None),
                             If(Eval('state') == 'draft',
                                 [
-                                    ('last_receipt.cash_bank.id',
+                                    ('current_cash_bank',
                                         '=', Eval('cash_bank_from')
                                     ),
                                 ],
                                 [
-                                    ('last_receipt.cash_bank.id',
+                                    ('current_cash_bank',
                                         '=', Eval('cash_bank_to')
                                     )
                                 ]
@@ -123,11 +127,11 @@ class Transfer(Workflow, ModelSQL, ModelView):
     total_documents = fields.Function(fields.Numeric('Total Documents',
             digits=(16, Eval('currency_digits', 2)),
             depends=['currency_digits']),
-            'get_total_documents')
+            'get_totals')
     total = fields.Function(fields.Numeric('Total',
             digits=(16, Eval('currency_digits', 2)),
             depends=['currency_digits']),
-            'get_total')
+            'get_totals')
     receipt_from = fields.Many2One('cash_bank.receipt', 'Receipt From',
         readonly=True)
     receipt_to = fields.Many2One('cash_bank.receipt', 'Receipt To',
@@ -197,20 +201,11 @@ class Transfer(Workflow, ModelSQL, ModelView):
 
     @staticmethod
     def default_currency():
-        Company = Pool().get('company.company')
-        company = Transaction().context.get('company')
-        if company:
-            company = Company(company)
-            return company.currency.id
+        return get_company_currency()[0]
 
     @staticmethod
     def default_currency_digits():
-        Company = Pool().get('company.company')
-        company = Transaction().context.get('company')
-        if company:
-            company = Company(company)
-            return company.currency.digits
-        return 2
+        return get_company_currency()[1]
 
     @fields.depends('currency')
     def on_change_with_currency_digits(self, name=None):
@@ -254,10 +249,10 @@ class Transfer(Workflow, ModelSQL, ModelView):
 
     @fields.depends('documents', 'cash', 'total_documents')
     def on_change_documents(self):
-        self.total_documents = self.get_total_documents()
+        self.total_documents = self._get_total_documents()
         self._set_total()
 
-    def get_total_documents(self, name=None):
+    def _get_total_documents(self):
         total = Decimal('0.0')
         if self.documents:
             for doc in self.documents:
@@ -265,9 +260,40 @@ class Transfer(Workflow, ModelSQL, ModelView):
                     total += doc.amount
         return total
 
-    def get_total(self, name=None):
-        total = self.cash + self.total_documents
-        return total
+    @classmethod
+    def get_totals(cls, transfers, names):
+        pool = Pool()
+        Document = pool.get('cash_bank.document')
+        DocumentTransfer = pool.get('cash_bank.document-cash_bank.transfer')
+        table = cls.__table__()
+        document = Document.__table__()
+        relation = DocumentTransfer.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {n: {t.id: Decimal('0.0') for t in transfers}
+            for n in names}
+        for sub_ids in grouped_slice([t.id for t in transfers]):
+            sub_ids = list(sub_ids)
+            documents = relation.join(document,
+                condition=relation.document == document.id
+                ).select(
+                    relation.transfer,
+                    Sum(document.amount).as_('amount'),
+                    where=reduce_ids(relation.transfer, sub_ids),
+                    group_by=[relation.transfer])
+            cursor.execute(*table.join(documents, 'LEFT',
+                    condition=documents.transfer == table.id
+                    ).select(table.id, table.cash, documents.amount,
+                    where=reduce_ids(table.id, sub_ids)))
+            for transfer_id, cash, amount in cursor:
+                total_documents = Decimal(str(amount or 0))
+                values = {
+                    'total_documents': total_documents,
+                    'total': Decimal(str(cash or 0)) + total_documents,
+                    }
+                for name in names:
+                    result[name][transfer_id] = values[name]
+        return result
 
     def _set_total(self):
         self.total = Decimal('0.0')
@@ -341,27 +367,34 @@ class Transfer(Workflow, ModelSQL, ModelView):
         Config = pool.get('cash_bank.configuration')
         Receipt = pool.get('cash_bank.receipt')
 
-        config = Config(1)
-        transfer_account = config.account_transfer
+        transfer_account = Config.get_cached_multivalue('account_transfer')
 
         if not transfer_account:
             raise UserError(
                 gettext('cash_bank.msg_no_transfer_account'
                 ))
 
-        receipt_from = self._create_receipt_from(
-                    self.cash_bank_from,
-                    self.type_from,
-                    transfer_account,
-                    self.documents)
-        Receipt.confirm([receipt_from])
-
-        receipt_to = self._create_receipt_to(
-                    self.cash_bank_to,
-                    self.type_to,
-                    transfer_account,
-                    self.documents)
-        Receipt.confirm([receipt_to])
+        with span('create_receipts'):
+            receipt_from = self._create_receipt_from(
+                        self.cash_bank_from,
+                        self.type_from,
+                        transfer_account,
+                        self.documents)
+            # The receipt is linked before its confirmation
+            # to record the movements of the documents as a transfer
+            self.set_transfer([receipt_from], self)
+        with span('confirm_receipts'):
+            Receipt.confirm([receipt_from])
+
+        with span('create_receipts'):
+            receipt_to = self._create_receipt_to(
+                        self.cash_bank_to,
+                        self.type_to,
+                        transfer_account,
+                        self.documents)
+            self.set_transfer([receipt_to], self)
+        with span('confirm_receipts'):
+            Receipt.confirm([receipt_to])
 
         self.receipt_from = receipt_from
         self.receipt_to = receipt_to
@@ -375,7 +408,7 @@ class Transfer(Workflow, ModelSQL, ModelView):
     @classmethod
     def create(cls, vlist):
         transfers = super(Transfer, cls).create(vlist)
-        write_log('Created', transfers)
+        add_log('Created', transfers)
         return transfers
 
     @classmethod
@@ -391,33 +424,31 @@ class Transfer(Workflow, ModelSQL, ModelView):
         super(Transfer, cls).delete(transfers)
 
     @classmethod
+    @instrumented
     @ModelView.button
     @Workflow.transition('draft')
     def draft(cls, transfers):
         Receipt = Pool().get('cash_bank.receipt')
         rcps = []
-        rcps_to = []
-        rcps_from = []
         for transfer in transfers:
             rcps += [
                 transfer.receipt_from,
                 transfer.receipt_to
             ]
-            rcps_to.append(transfer.receipt_to)
-            rcps_from.append(transfer.receipt_from)
-
             transfer.receipt_from = None
             transfer.receipt_to = None
 
         Receipt.draft(rcps)
-        # Deletion order is important for Documents update
-        Receipt.delete(rcps_to)
-        Receipt.delete(rcps_from)
+        # Both receipts are deleted at once as the documents are returned
+        # to their last receipt before all the deleted ones
+        Receipt.delete(rcps)
 
         cls.save(transfers)
-        write_log('Draft', transfers)
+        add_log('Draft', transfers)
 
     @classmethod
+    @queue_workflow
+    @instrumented
     @ModelView.button
     @Workflow.transition('confirmed')
     def confirm(cls, transfers):
@@ -427,15 +458,12 @@ class Transfer(Workflow, ModelSQL, ModelView):
                     gettext('cash_bank.msg_transfer_no_total'
                     ))
             transfer.create_receipts()
-            cls.set_transfer([
-                transfer.receipt_from,
-                transfer.receipt_to
-                ],
-                transfer)
         cls.save(transfers)  # Update receipts values
-        write_log('Confirmed', transfers)
+        add_log('Confirmed', transfers)
 
     @classmethod
+    @queue_workflow
+    @instrumented
     @ModelView.button
     @Workflow.transition('posted')
     def post(cls, transfers):
@@ -451,21 +479,23 @@ class Transfer(Workflow, ModelSQL, ModelView):
                 transfer.receipt_to
                 ]
         Receipt.post(rcps)
-        write_log('Posted', transfers)
+        add_log('Posted', transfers)
 
     @classmethod
+    @instrumented
     @ModelView.button
     @Workflow.transition('cancel')
     def cancel(cls, transfers):
         Receipt = Pool().get('cash_bank.receipt')
         rcps = []
-        for transfer in transfers:
+        for transfer in cls.browse(transfers):
             rcps += [
                 transfer.receipt_from,
                 transfer.receipt_to
                 ]
-        Receipt.cancel(rcps)
-        write_log('Cancelled', transfers)
+        # The receipts of all the transfers are cancelled as one batch
+        Receipt.cancel([r for r in rcps if r])
+        add_log('Cancelled', transfers)
 
 
 class DocumentTransfer(ModelSQL):
@@ -476,6 +506,17 @@ class DocumentTransfer(ModelSQL):
     transfer = fields.Many2One('cash_bank.transfer', 'Transfer',
         ondelete='CASCADE', required=True)
 
+    @classmethod
+    def __setup__(cls):
+        super(DocumentTransfer, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.transfer, Index.Equality()),
+                    (t.document, Index.Equality())),
+                Index(t, (t.document, Index.Equality())),
+                })
+
 
 class TransferLog(LogActionMixin):
     "Transfer Logs"